@@ -0,0 +1,233 @@
+"""Offline benchmark of the music hot paths: /play, the per-guild player task and prefetching.
+
+yt_dlp extraction is replaced by a stub with a configurable delay, and voice
+and text channels by in-memory fakes, so nothing touches the network, FFmpeg
+or Discord. Reports time-to-first-audio, the gap between songs, event loop
+lag and the memory a queued guild holds.
+
+Run from the repository root:
+    python -m benchmarks.music_playback --guilds 50 --tracks 20
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import threading
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+# Module-level singletons read these on import: no SQLite journal, no disk cache,
+# and disconnect as soon as a queue runs dry so every player task finishes
+os.environ["MUSIC_STATE_DB"] = ""
+os.environ.pop("MUSIC_DISK_CACHE_DIR", None)
+os.environ["MUSIC_IDLE_DISCONNECT"] = "0"
+
+import utils.extraction
+from cogs.music import Music
+from utils import music_utils
+from utils.extraction import extractor
+from utils.music_queue import Track
+
+extraction_delay = 0.0
+
+
+def _stub_extraction(url, opts):
+    """Stands in for yt_dlp inside the worker pool: sleeps, then returns a minimal info dict"""
+    time.sleep(extraction_delay)
+    video_id = url.rsplit("=", 1)[-1]
+    return {
+        'id': video_id,
+        'title': f"Benchmark song {video_id}",
+        'url': f"https://stream.invalid/{video_id}?expire={int(time.time()) + 6 * 3600}",
+        'duration': 180,
+        'thumbnail': None,
+        'acodec': 'opus',
+        'abr': 128,
+    }
+
+
+class FakeSource:
+    mode = 'passthrough'
+
+
+async def _fake_create_source(info):
+    return FakeSource()
+
+
+class FakeVoiceClient:
+    """Plays each song for a fixed time, calling after() from another thread like discord.py's player"""
+
+    def __init__(self, song_seconds, timings):
+        self.song_seconds = song_seconds
+        self.timings = timings
+        self._connected = True
+        self._timer = None
+
+    def is_connected(self):
+        return self._connected
+
+    def is_playing(self):
+        return self._timer is not None and self._timer.is_alive()
+
+    def play(self, source, after=None):
+        now = time.perf_counter()
+        if self.timings['ended_at'] is None:
+            self.timings['first_audio'].append(now - self.timings['requested_at'])
+        else:
+            self.timings['gaps'].append(now - self.timings['ended_at'])
+        self._timer = threading.Timer(self.song_seconds, self._finish, args=(after,))
+        self._timer.start()
+
+    def _finish(self, after):
+        self.timings['ended_at'] = time.perf_counter()
+        if after is not None:
+            after(None)
+
+    def stop(self):
+        if self._timer is not None:
+            self._timer.cancel()
+
+    async def disconnect(self):
+        self.stop()
+        self._connected = False
+
+
+class FakeTextChannel:
+    def __init__(self):
+        self.sent = 0
+
+    async def send(self, *args, **kwargs):
+        self.sent += 1
+
+
+class FakeResponse:
+    async def defer(self):
+        pass
+
+    async def send_message(self, *args, **kwargs):
+        pass
+
+
+def _fake_interaction(guild_id, user_id, text_channel, voice_channel):
+    return SimpleNamespace(
+        guild=SimpleNamespace(id=guild_id),
+        user=SimpleNamespace(id=user_id, name=f"user_{user_id}", voice=SimpleNamespace(channel=voice_channel)),
+        channel=text_channel,
+        response=FakeResponse(),
+        followup=text_channel,
+    )
+
+
+def _fake_voice_channel(guild_id, song_seconds, timings):
+    async def connect():
+        return FakeVoiceClient(song_seconds, timings)
+    return SimpleNamespace(guild=SimpleNamespace(id=guild_id, voice_client=None), connect=connect)
+
+
+def _video_url(guild_id, index):
+    return f"https://www.youtube.com/watch?v=g{guild_id:04d}t{index:05d}"
+
+
+async def _sample_loop_lag(interval, samples, stop):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        started = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(loop.time() - started - interval)
+
+
+async def measure_memory(guilds, tracks):
+    """Bytes held per guild for a player whose queue has `tracks` resolved songs"""
+    infos = [
+        [await extractor.resolve(_video_url(guild_id, i), guild_id) for i in range(tracks)]
+        for guild_id in range(guilds)
+    ]
+    extractor.cache.clear()
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for guild_id in range(guilds):
+        player = music_utils.get_player(guild_id)
+        for i, info in enumerate(infos[guild_id]):
+            player.queue.append(Track.from_url(_video_url(guild_id, i), info['title'], guild_id, info))
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    music_utils.players.clear()
+    return sum(stat.size_diff for stat in after.compare_to(before, 'filename')) / guilds
+
+
+async def run_playback(guilds, tracks, song_seconds):
+    """/play one song per guild, queue the rest behind it like a playlist import, and let the players drain"""
+    cog = Music(bot=None)
+    all_timings = []
+    lag_samples = []
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(_sample_loop_lag(0.01, lag_samples, stop))
+
+    async def guild_session(guild_id):
+        timings = {'requested_at': time.perf_counter(), 'ended_at': None, 'first_audio': [], 'gaps': []}
+        all_timings.append(timings)
+        text_channel = FakeTextChannel()
+        voice_channel = _fake_voice_channel(guild_id, song_seconds, timings)
+        interaction = _fake_interaction(guild_id, 1000, text_channel, voice_channel)
+        await Music.play.callback(cog, interaction, _video_url(guild_id, 0))
+        # Unresolved, as /play_playlist leaves them: each one is resolved by prefetch or on its turn
+        for i in range(1, tracks):
+            video_id = _video_url(guild_id, i).rsplit("=", 1)[-1]
+            music_utils.add_to_playlist(guild_id, Track(video_id, f"Benchmark song {video_id}", 1000 + i % 5))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(guild_session(guild_id) for guild_id in range(guilds)))
+    await asyncio.gather(*(player._task for player in music_utils.players.values() if player._task))
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await lag_task
+    music_utils.players.clear()
+    first_audio = [t for timings in all_timings for t in timings['first_audio']]
+    gaps = [g for timings in all_timings for g in timings['gaps']]
+    return elapsed, first_audio, gaps, lag_samples
+
+
+def _summary(values):
+    if not values:
+        return "n/a"
+    ordered = sorted(values)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    return (f"p50 {statistics.median(ordered) * 1000:7.2f} ms  "
+            f"p95 {p95 * 1000:7.2f} ms  max {ordered[-1] * 1000:7.2f} ms  (n={len(ordered)})")
+
+
+async def main():
+    global extraction_delay
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--guilds", type=int, default=50)
+    parser.add_argument("--tracks", type=int, default=20)
+    parser.add_argument("--song-seconds", type=float, default=0.2, help="How long each fake song plays")
+    parser.add_argument("--extraction-delay", type=float, default=0.05, help="Simulated yt_dlp time per video")
+    args = parser.parse_args()
+
+    utils.extraction._run_extraction = _stub_extraction
+    # The stub can't be pickled into a process pool
+    extractor.use_processes = False
+    music_utils.create_source = _fake_create_source
+
+    memory = await measure_memory(args.guilds, args.tracks)
+
+    extraction_delay = args.extraction_delay
+    elapsed, first_audio, gaps, lag = await run_playback(args.guilds, args.tracks, args.song_seconds)
+    extractor.shutdown()
+
+    print(f"{args.guilds} guilds x {args.tracks} tracks, {args.song_seconds:g}s songs, "
+          f"{args.extraction_delay:g}s extraction, {extractor.max_workers} workers")
+    print(f"  wall time:           {elapsed:.2f}s")
+    print(f"  time to first audio: {_summary(first_audio)}")
+    print(f"  inter-track gap:     {_summary(gaps)}")
+    print(f"  event loop lag:      {_summary(lag)}")
+    print(f"  memory per guild:    {memory / 1024:.1f} KiB ({memory / args.tracks:.0f} bytes/track)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
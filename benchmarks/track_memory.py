@@ -0,0 +1,79 @@
+"""Bytes per queued track: legacy (url, title, added_by) tuples vs slotted Track records.
+
+Run from the repository root:
+    python -m benchmarks.track_memory --guilds 200 --tracks 500
+"""
+import argparse
+import random
+import string
+import tracemalloc
+
+from utils.music_queue import GuildQueue, Track
+
+
+def _random_id():
+    return "".join(random.choices(string.ascii_letters + string.digits + "-_", k=11))
+
+
+def _song_specs(guilds, tracks, requesters):
+    # Materialize inputs up front so only the queue structures are measured
+    users = [(random.randrange(10**17, 10**18), f"user_{i}") for i in range(requesters)]
+    specs = []
+    for _ in range(guilds):
+        guild_songs = []
+        for _ in range(tracks):
+            user_id, user_name = random.choice(users)
+            video_id = _random_id()
+            guild_songs.append((video_id, f"Song title {video_id}", int(str(user_id)), "".join(user_name)))
+        specs.append(guild_songs)
+    return specs
+
+
+def _measure(build):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    queues = build()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    allocated = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    return queues, allocated
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--guilds", type=int, default=200)
+    parser.add_argument("--tracks", type=int, default=500)
+    parser.add_argument("--requesters", type=int, default=50)
+    args = parser.parse_args()
+
+    specs = _song_specs(args.guilds, args.tracks, args.requesters)
+    total = args.guilds * args.tracks
+
+    def build_tuples():
+        # The layout used before Track: full URL, title and requester name per entry
+        return [
+            [(f"https://www.youtube.com/watch?v={video_id}", title, user_name)
+             for video_id, title, _, user_name in guild_songs]
+            for guild_songs in specs
+        ]
+
+    def build_tracks():
+        queues = []
+        for guild_songs in specs:
+            queue = GuildQueue()
+            for video_id, title, user_id, _ in guild_songs:
+                queue.append(Track(video_id, title, user_id))
+            queues.append(queue)
+        return queues
+
+    _, tuple_bytes = _measure(build_tuples)
+    _, track_bytes = _measure(build_tracks)
+
+    print(f"{args.guilds} guilds x {args.tracks} tracks ({total} queued, {args.requesters} requesters)")
+    print(f"  tuples: {tuple_bytes / total:7.1f} bytes/track  ({tuple_bytes / 1024 / 1024:.1f} MiB)")
+    print(f"  Track:  {track_bytes / total:7.1f} bytes/track  ({track_bytes / 1024 / 1024:.1f} MiB)")
+    print("  Titles and requester values are pre-built and shared, so only per-entry storage is counted.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,67 @@
+import os
+
 import discord
 from discord.ext import tasks
 from utils import cobbleverse_utils
 
-@tasks.loop(minutes=10)
+# Poll quickly while the server is starting/stopping, then back off towards the max while nothing changes
+PRESENCE_FAST_INTERVAL = float(os.getenv("PRESENCE_FAST_INTERVAL", "15"))
+PRESENCE_MIN_INTERVAL = float(os.getenv("PRESENCE_MIN_INTERVAL", "60"))
+PRESENCE_MAX_INTERVAL = float(os.getenv("PRESENCE_MAX_INTERVAL", "600"))
+# Usage is rounded to this many percent so small fluctuations don't count as a change
+PRESENCE_ROUNDING = 5
+
+presence_state = {'message': None, 'status': None, 'interval': PRESENCE_MIN_INTERVAL}
+
+def _rounded_percent(value):
+    if value is None:
+        return "N/A"
+    return f"~{round(value / PRESENCE_ROUNDING) * PRESENCE_ROUNDING:g}%"
+
+def render_presence(snapshot):
+    cpu_usage = _rounded_percent(snapshot.cpu_percent)
+    mem_usage = _rounded_percent(snapshot.mem_percent)
+    return f"Cobbleverse - CPU: {cpu_usage}, Memory: {mem_usage}, Status: {snapshot.status.value}"
+
+def next_interval(snapshot, changed):
+    transitioning = (
+        snapshot.status is cobbleverse_utils.ServerStatus.STARTING
+        or snapshot.status is not presence_state['status']
+        or cobbleverse_utils.lifecycle_lock.locked()
+    )
+    if transitioning:
+        return PRESENCE_FAST_INTERVAL
+    if changed:
+        return PRESENCE_MIN_INTERVAL
+    return min(presence_state['interval'] * 2, PRESENCE_MAX_INTERVAL)
+
+@tasks.loop(seconds=PRESENCE_MIN_INTERVAL)
 async def update_bot_status(client):
-    _, cpu_usage, mem_usage, server_status = await cobbleverse_utils.check_cobbleverse_server()
-    status_message = f"Cobbleverse - CPU: {cpu_usage}, Memory: {mem_usage}, Status: {server_status}"
-    await client.change_presence(activity=discord.Game(name=status_message))
+    # Only ask for a fresh `mcserver details` run while the server is changing state; otherwise
+    # the sampler's own background refresh is recent enough
+    max_age = presence_state['interval']
+    if max_age > PRESENCE_FAST_INTERVAL:
+        max_age = max(max_age, cobbleverse_utils.sampler.refresh_interval)
+    snapshot, _ = await cobbleverse_utils.sampler.get(max_age=max_age)
+    status_message = render_presence(snapshot)
+    changed = status_message != presence_state['message']
+    if changed:
+        await client.change_presence(activity=discord.Game(name=status_message))
+        presence_state['message'] = status_message
+
+    interval = next_interval(snapshot, changed)
+    presence_state['status'] = snapshot.status
+    if interval != presence_state['interval']:
+        presence_state['interval'] = interval
+        update_bot_status.change_interval(seconds=interval)
+
+def _poll_fast(action):
+    # Don't sit out the rest of a backed-off sleep while the server is changing state
+    presence_state['interval'] = PRESENCE_FAST_INTERVAL
+    update_bot_status.change_interval(seconds=PRESENCE_FAST_INTERVAL)
+
+cobbleverse_utils.lifecycle_listeners.append(_poll_fast)
 
 def start_update_task(client):
-    update_bot_status.start(client)
\ No newline at end of file
+    if not update_bot_status.is_running():
+        update_bot_status.start(client)
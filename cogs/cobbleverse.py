@@ -1,12 +1,24 @@
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 from discord import app_commands
 from utils import cobbleverse_utils
+import asyncio
+import logging
 import os
+import time
+from collections import deque
+from datetime import datetime, timezone
 from dotenv import load_dotenv
 
+logger = logging.getLogger(__name__)
+
 load_dotenv()
 cobbleverse_domain = os.getenv("COBBLEVERSE_DOMAIN", "cobbleverse.example.com")
+# Channel that receives batched join/leave/death/chat messages from the server log (unset disables)
+events_channel_id = int(os.getenv("COBBLEVERSE_EVENTS_CHANNEL_ID", "0"))
+events_interval = float(os.getenv("COBBLEVERSE_EVENTS_INTERVAL", "10"))
+relay_chat = os.getenv("COBBLEVERSE_RELAY_CHAT", "true").lower() == "true"
+EVENT_ICONS = {'join': "📥", 'leave': "📤", 'death': "💀", 'chat': "💬", 'server': "⛏️"}
 
 
 def is_owner():
@@ -16,32 +28,145 @@ def is_owner():
         return interaction.user.id == owner_id
     return app_commands.check(predicate)
 
+class LiveOutput:
+    """Mirrors a command's output into one Discord message, editing it at most once per EDIT_INTERVAL"""
+    
+    EDIT_INTERVAL = 1.5
+    # Leaves room for the header and code fences within Discord's 2000 character limit
+    MAX_CHARS = 1800
+    
+    def __init__(self, message, header):
+        self.message = message
+        self.header = header
+        self.lines = deque()
+        self.chars = 0
+        self._edit_task = None
+        self._last_edit = 0.0
+    
+    def render(self):
+        if not self.lines:
+            return self.header
+        return f"{self.header}\n```{chr(10).join(self.lines)}```"
+    
+    def feed(self, line):
+        line = line[:self.MAX_CHARS]
+        self.lines.append(line)
+        self.chars += len(line) + 1
+        while self.chars > self.MAX_CHARS:
+            self.chars -= len(self.lines.popleft()) + 1
+        if self._edit_task is None or self._edit_task.done():
+            self._edit_task = asyncio.create_task(self._edit_later())
+    
+    async def _edit_later(self):
+        await asyncio.sleep(max(0.0, self._last_edit + self.EDIT_INTERVAL - time.monotonic()))
+        self._last_edit = time.monotonic()
+        try:
+            await self.message.edit(content=self.render())
+        except discord.HTTPException:
+            pass
+    
+    async def finish(self, header):
+        if self._edit_task is not None:
+            self._edit_task.cancel()
+        self.header = header
+        await self.message.edit(content=self.render())
+
 class Cobbleverse(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self.event_backlog = deque(maxlen=500)
+    
+    async def cog_load(self):
+        cobbleverse_utils.sampler.start()
+        cobbleverse_utils.log_follower.start()
+        if events_channel_id:
+            self.relay_events.change_interval(seconds=events_interval)
+            self.relay_events.start()
+    
+    async def cog_unload(self):
+        cobbleverse_utils.sampler.stop()
+        cobbleverse_utils.log_follower.stop()
+        self.relay_events.cancel()
+    
+    @staticmethod
+    def format_event(event):
+        escape = discord.utils.escape_markdown
+        if event.kind == 'join':
+            text = f"**{escape(event.player)}** joined the game"
+        elif event.kind == 'leave':
+            text = f"**{escape(event.player)}** left the game"
+        elif event.kind == 'chat':
+            text = f"<{escape(event.player)}> {escape(event.text)}"
+        else:
+            text = escape(event.text)
+        return f"{EVENT_ICONS[event.kind]} {text}"
+    
+    @tasks.loop(seconds=10)
+    async def relay_events(self):
+        """Post everything the log follower picked up since the last run as one message"""
+        for event in cobbleverse_utils.log_follower.drain():
+            if event.kind != 'chat' or relay_chat:
+                self.event_backlog.append(self.format_event(event))
+        if not self.event_backlog:
+            return
+        
+        channel = self.bot.get_channel(events_channel_id)
+        if channel is None:
+            return
+        
+        # One message per run keeps us well inside the rate limit; anything left over goes next time
+        lines = []
+        length = 0
+        while self.event_backlog and length + len(self.event_backlog[0]) + 1 <= 2000:
+            line = self.event_backlog.popleft()
+            lines.append(line)
+            length += len(line) + 1
+        if not lines:
+            # A single line longer than a whole message
+            lines.append(self.event_backlog.popleft()[:2000])
+        try:
+            await channel.send("\n".join(lines), allowed_mentions=discord.AllowedMentions.none())
+        except discord.HTTPException as e:
+            logger.warning(f"Failed to relay Cobbleverse events: {e}")
+    
+    @relay_events.before_loop
+    async def before_relay_events(self):
+        await self.bot.wait_until_ready()
     
     @app_commands.command(name="cobbleverse_status", description="Check Cobbleverse server status")
     async def cobbleverse_status(self, interaction: discord.Interaction):
         try:
             await interaction.response.defer()
-            server_ip, cpu_usage, mem_usage, server_status = await cobbleverse_utils.check_cobbleverse_server()
+            snapshot, sampled_at = await cobbleverse_utils.sampler.get()
             
-            if server_ip.startswith("Error"):
+            if snapshot.error:
                 await interaction.followup.send(
-                    f"❌ Failed to get server status: {server_ip}", 
+                    f"❌ Failed to get server status: {snapshot.error}", 
                     ephemeral=True
                 )
                 return
             
-            color = 0x2ecc71 if server_status == "STARTED" else 0xe74c3c
-            thumbnail_url = "https://www.minecraft.net/content/dam/games/minecraft/logos/Minecraft-logo.png" if server_status == "STARTED" else "https://www.minecraft.net/content/dam/games/minecraft/screenshots/carousel-alex-sunset.jpg"
+            if snapshot.online:
+                color = 0x2ecc71
+            elif snapshot.status is cobbleverse_utils.ServerStatus.STARTING:
+                color = 0xf1c40f
+            else:
+                color = 0xe74c3c
+            thumbnail_url = "https://www.minecraft.net/content/dam/games/minecraft/logos/Minecraft-logo.png" if snapshot.online else "https://www.minecraft.net/content/dam/games/minecraft/screenshots/carousel-alex-sunset.jpg"
             
-            embed = discord.Embed(title="⛏️ Cobbleverse Server Status", color=color)
+            embed = discord.Embed(
+                title="⛏️ Cobbleverse Server Status",
+                color=color,
+                timestamp=datetime.fromtimestamp(sampled_at, tz=timezone.utc)
+            )
             embed.add_field(name="🔗 Connection", value=cobbleverse_domain, inline=True)
-            embed.add_field(name="🖥️ CPU Usage", value=cpu_usage, inline=True)
-            embed.add_field(name="💾 Memory Usage", value=mem_usage, inline=True)
+            embed.add_field(name="🖥️ CPU Usage", value=cobbleverse_utils.format_percent(snapshot.cpu_percent), inline=True)
+            embed.add_field(name="💾 Memory Usage", value=cobbleverse_utils.format_percent(snapshot.mem_percent), inline=True)
+            if snapshot.players is not None:
+                players = f"{snapshot.players}/{snapshot.max_players}" if snapshot.max_players else str(snapshot.players)
+                embed.add_field(name="👥 Players", value=players, inline=True)
             
-            embed.set_footer(text=f"Server Status: {server_status}")
+            embed.set_footer(text=f"Server Status: {snapshot.status.value} • Last checked")
             embed.set_thumbnail(url=thumbnail_url)
             embed.set_author(name=interaction.user.display_name, icon_url=interaction.user.avatar.url if interaction.user.avatar else None)
             
@@ -52,21 +177,85 @@ class Cobbleverse(commands.Cog):
                 ephemeral=True
             )
     
-    @app_commands.command(name="cobbleverse_start", description="Start the Cobbleverse server")
-    @is_owner()
-    async def cobbleverse_start(self, interaction: discord.Interaction):
+    @app_commands.command(name="cobbleverse_players", description="List players currently on the Cobbleverse server")
+    async def cobbleverse_players(self, interaction: discord.Interaction):
         try:
-            await interaction.response.defer()
-            returncode, stdout, stderr = await cobbleverse_utils.start_cobbleverse_server()
-            
-            if returncode is None:
-                await interaction.followup.send("⏱️ Timeout occurred while starting the Cobbleverse server.")
+            follower = cobbleverse_utils.log_follower
+            if follower.started_at is None:
+                await interaction.response.send_message("The server log hasn't been read yet. Please try again in a moment.")
                 return
             
-            if returncode == 0:
-                await interaction.followup.send(f"✅ Cobbleverse server started successfully.\n```{stdout}```")
+            online = sorted(follower.online.items(), key=lambda item: item[1])
+            embed = discord.Embed(title=f"👥 Cobbleverse Players Online: {len(online)}", color=0x2ecc71 if online else 0x95a5a6)
+            if online:
+                embed.description = "\n".join(
+                    f"**{discord.utils.escape_markdown(name)}** — joined <t:{int(joined_at)}:R>" for name, joined_at in online
+                )
             else:
-                await interaction.followup.send(f"❌ Failed to start Cobbleverse server.\nError:```{stderr}```")
+                embed.description = "Nobody is online right now."
+            embed.set_footer(text="Tracked live from the server log")
+            
+            await interaction.response.send_message(embed=embed)
+        except Exception as e:
+            await interaction.response.send_message(
+                f"❌ An error occurred: {str(e)}",
+                ephemeral=True
+            )
+    
+    @app_commands.command(name="cobbleverse_history", description="Show Cobbleverse server usage over the last few hours")
+    @app_commands.describe(hours="How many hours back to summarize (default 6)")
+    async def cobbleverse_history(self, interaction: discord.Interaction, hours: app_commands.Range[int, 1, 168] = 6):
+        try:
+            history = cobbleverse_utils.sampler.history
+            samples, summary = history.summarize(time.time() - hours * 3600)
+            
+            if not samples:
+                await interaction.response.send_message("No status samples recorded yet. Try again after the next status check.")
+                return
+            
+            embed = discord.Embed(title=f"📈 Cobbleverse Server — Last {hours}h", color=0x3498db)
+            for name, metric, unit in (("🖥️ CPU Usage", 'cpu_percent', "%"), ("💾 Memory Usage", 'mem_percent', "%"), ("👥 Players", 'players', "")):
+                stats = summary[metric]
+                value = f"min {stats[0]:g}{unit} • avg {stats[1]:.1f}{unit} • max {stats[2]:g}{unit}" if stats else "No data"
+                embed.add_field(name=name, value=value, inline=False)
+            online = summary['online']
+            embed.add_field(name="🟢 Online", value=f"{online[1] * 100:.0f}% of samples" if online else "No data", inline=False)
+            embed.set_footer(text=f"{samples} sample(s), one every {cobbleverse_utils.sampler.refresh_interval:g}s")
+            
+            await interaction.response.send_message(embed=embed)
+        except Exception as e:
+            await interaction.response.send_message(
+                f"❌ An error occurred: {str(e)}",
+                ephemeral=True
+            )
+    
+    async def _run_lifecycle(self, interaction: discord.Interaction, action, verb, present, past):
+        lock = cobbleverse_utils.lifecycle_lock
+        if lock.locked():
+            await interaction.response.send_message("⏳ Another start/stop/restart is still running. Please wait for it to finish.")
+            return
+        # The lock is free, so this takes it without yielding and a second command sees it held
+        await lock.acquire()
+        try:
+            await interaction.response.defer()
+            message = await interaction.followup.send(f"⏳ {present} the Cobbleverse server...", wait=True)
+            live = LiveOutput(message, f"⏳ {present} the Cobbleverse server...")
+            returncode, output = await action(live.feed)
+        finally:
+            lock.release()
+        
+        if returncode is None:
+            await live.finish(f"⏱️ Timeout occurred while {present.lower()} the Cobbleverse server.")
+        elif returncode == 0:
+            await live.finish(f"✅ Cobbleverse server {past} successfully.")
+        else:
+            await live.finish(f"❌ Failed to {verb} Cobbleverse server.")
+    
+    @app_commands.command(name="cobbleverse_start", description="Start the Cobbleverse server")
+    @is_owner()
+    async def cobbleverse_start(self, interaction: discord.Interaction):
+        try:
+            await self._run_lifecycle(interaction, cobbleverse_utils.start_cobbleverse_server, "start", "Starting", "started")
         except Exception as e:
             await interaction.followup.send(f"❌ An error occurred: {e}")
     
@@ -74,17 +263,7 @@ class Cobbleverse(commands.Cog):
     @is_owner()
     async def cobbleverse_stop(self, interaction: discord.Interaction):
         try:
-            await interaction.response.defer()
-            returncode, stdout, stderr = await cobbleverse_utils.stop_cobbleverse_server()
-            
-            if returncode is None:
-                await interaction.followup.send("⏱️ Timeout occurred while stopping the Cobbleverse server.")
-                return
-            
-            if returncode == 0:
-                await interaction.followup.send(f"✅ Cobbleverse server stopped successfully.\n```{stdout}```")
-            else:
-                await interaction.followup.send(f"❌ Failed to stop Cobbleverse server.\nError:```{stderr}```")
+            await self._run_lifecycle(interaction, cobbleverse_utils.stop_cobbleverse_server, "stop", "Stopping", "stopped")
         except Exception as e:
             await interaction.followup.send(f"❌ An error occurred: {e}")
     
@@ -92,17 +271,7 @@ class Cobbleverse(commands.Cog):
     @is_owner()
     async def cobbleverse_restart(self, interaction: discord.Interaction):
         try:
-            await interaction.response.defer()
-            returncode, stdout, stderr = await cobbleverse_utils.restart_cobbleverse_server()
-            
-            if returncode is None:
-                await interaction.followup.send("⏱️ Timeout occurred while restarting the Cobbleverse server.")
-                return
-            
-            if returncode == 0:
-                await interaction.followup.send(f"✅ Cobbleverse server restarted successfully.\n```{stdout}```")
-            else:
-                await interaction.followup.send(f"❌ Failed to restart Cobbleverse server.\nError:```{stderr}```")
+            await self._run_lifecycle(interaction, cobbleverse_utils.restart_cobbleverse_server, "restart", "Restarting", "restarted")
         except Exception as e:
             await interaction.followup.send(f"❌ An error occurred: {e}")
     
@@ -137,6 +306,8 @@ class Cobbleverse(commands.Cog):
                 name="📋 Available Commands",
                 value=(
                     "`/cobbleverse_status` - Check server status\n"
+                    "`/cobbleverse_history` - Usage over the last hours\n"
+                    "`/cobbleverse_players` - Who is online right now\n"
                     "`/cobbleverse_start` - Start server (owner only)\n"
                     "`/cobbleverse_stop` - Stop server (owner only)\n"
                     "`/cobbleverse_restart` - Restart server (owner only)"
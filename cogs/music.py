@@ -2,14 +2,21 @@ import discord
 from discord.ext import commands
 from discord import app_commands
 from utils import music_utils
-import yt_dlp
-from discord.utils import get
+from utils.music_queue import Track
+from utils.music_store import store
+from utils.extraction import extractor
+from utils.youtube_search import YouTubeSearchClient, search_cache
 import os
-from googleapiclient.discovery import build
 from dotenv import load_dotenv
 
 load_dotenv()
 gcp_api_key = os.getenv("GCP_API_KEY")
+# Most songs a single /play_playlist may queue
+playlist_import_max = int(os.getenv("MUSIC_PLAYLIST_MAX", "200"))
+# Songs queued between progress message edits
+PLAYLIST_IMPORT_BATCH = 50
+# Songs shown per /view_playlist page
+PLAYLIST_PAGE_SIZE = 10
 
 def is_owner():
     """Custom check for owner-only commands"""
@@ -18,14 +25,123 @@ def is_owner():
         return interaction.user.id == owner_id
     return app_commands.check(predicate)
 
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+class PlaylistView(discord.ui.View):
+    """Pages through a guild's queue, rendering only the page being looked at.
+
+    Rendered pages are kept until the queue's version changes.
+    """
+    
+    def __init__(self, guild_id):
+        super().__init__(timeout=180)
+        self.queue = music_utils.get_queue(guild_id)
+        self.page = 0
+        self.message = None
+        self._pages = {}
+        self._version = None
+    
+    @property
+    def page_count(self):
+        return max(1, -(-len(self.queue) // PLAYLIST_PAGE_SIZE))
+    
+    def render(self):
+        if self._version != self.queue.version:
+            self._pages.clear()
+            self._version = self.queue.version
+        self.page = min(self.page, self.page_count - 1)
+        embed = self._pages.get(self.page)
+        if embed is None:
+            embed = self._pages[self.page] = self._render_page(self.page)
+        
+        self.first.disabled = self.previous.disabled = self.page == 0
+        self.next.disabled = self.last.disabled = self.page >= self.page_count - 1
+        return embed
+    
+    def _render_page(self, page):
+        queue = self.queue
+        embed = discord.Embed(title="Server Playlist", color=discord.Color.blue())
+        
+        if queue.current:
+            embed.add_field(
+                name="Currently Playing",
+                value=f"[{queue.current.title[:80]}]({queue.current.url}) (added by {queue.current.requester})",
+                inline=False
+            )
+        
+        start = page * PLAYLIST_PAGE_SIZE
+        lines = []
+        for i, track in enumerate(queue.page(start, PLAYLIST_PAGE_SIZE), start=start + 1):
+            duration = f" `{format_duration(track.duration)}`" if track.duration else ""
+            lines.append(f"{i}. [{track.title[:80]}]({track.url}){duration} (added by {track.requester})")
+        embed.description = "**Up Next:**\n" + "\n".join(lines) if lines else "*No songs in queue*"
+        
+        footer = f"Page {page + 1}/{self.page_count} · {len(queue)} song(s) queued"
+        if queue.looping:
+            footer += " · 🔁 Loop mode is ON"
+        embed.set_footer(text=footer)
+        return embed
+    
+    async def _show(self, interaction: discord.Interaction, page):
+        self.page = page
+        await interaction.response.edit_message(embed=self.render(), view=self)
+    
+    @discord.ui.button(emoji="⏮️", style=discord.ButtonStyle.secondary)
+    async def first(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self._show(interaction, 0)
+    
+    @discord.ui.button(emoji="◀️", style=discord.ButtonStyle.primary)
+    async def previous(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self._show(interaction, max(0, self.page - 1))
+    
+    @discord.ui.button(emoji="▶️", style=discord.ButtonStyle.primary)
+    async def next(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self._show(interaction, self.page + 1)
+    
+    @discord.ui.button(emoji="⏭️", style=discord.ButtonStyle.secondary)
+    async def last(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self._show(interaction, self.page_count - 1)
+    
+    async def on_timeout(self):
+        if self.message is not None:
+            try:
+                await self.message.edit(view=None)
+            except discord.HTTPException:
+                pass
+
 class Music(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.youtube = None
         
     async def cog_load(self):
+        if store:
+            await store.preload()
+        if music_utils.audio_cache:
+            await music_utils.audio_cache.load()
         if gcp_api_key:
-            self.youtube = build("youtube", "v3", developerKey=gcp_api_key)
+            self.youtube = YouTubeSearchClient.from_env(gcp_api_key)
+    
+    async def cog_unload(self):
+        extractor.shutdown()
+        if music_utils.audio_cache:
+            await music_utils.audio_cache.close()
+        if store:
+            await store.close()
+        if self.youtube is not None:
+            await self.youtube.close()
+    
+    @commands.Cog.listener()
+    async def on_voice_state_update(self, member: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
+        # Keep each player's voice client in step with the bot's own voice state
+        if member.id != self.bot.user.id:
+            return
+        player = music_utils.players.get(member.guild.id)
+        if player is not None:
+            player.voice_client = member.guild.voice_client if after.channel else None
     
     @app_commands.command(name="join", description="Join a voice channel")
     async def join(self, interaction: discord.Interaction):
@@ -33,39 +149,111 @@ class Music(commands.Cog):
             await interaction.response.send_message("You are not in a voice channel.")
             return
         channel = interaction.user.voice.channel
-        await channel.connect()
+        player = music_utils.get_player(interaction.guild.id)
+        player.text_channel = interaction.channel
+        await player.connect(channel)
         await interaction.response.send_message(f"Joined {channel.name}")
     
     @app_commands.command(name="leave", description="Leave the voice channel")
     async def leave(self, interaction: discord.Interaction):
-        if interaction.guild.voice_client is None:
+        player = music_utils.get_player(interaction.guild.id)
+        if not player.is_connected():
             await interaction.response.send_message("I am not in a voice channel.")
             return
-        await interaction.guild.voice_client.disconnect()
+        await player.disconnect()
         await interaction.response.send_message("Left the voice channel")
     
     @app_commands.command(name="disable_youtube", description="Disable YouTube search")
     @is_owner()
     async def disable_youtube(self, interaction: discord.Interaction):
+        if self.youtube is not None:
+            await self.youtube.close()
         self.youtube = None
         await interaction.response.send_message("Youtube search disabled.")
     
     @app_commands.command(name="enable_youtube", description="Enable YouTube search")
     @is_owner()
     async def enable_youtube(self, interaction: discord.Interaction):
-        self.youtube = build("youtube", "v3", developerKey=gcp_api_key)
+        if self.youtube is None:
+            self.youtube = YouTubeSearchClient.from_env(gcp_api_key)
         await interaction.response.send_message("Youtube search enabled.")
     
+    @app_commands.command(name="extraction_stats", description="Show YouTube extraction worker statistics")
+    @is_owner()
+    async def extraction_stats(self, interaction: discord.Interaction):
+        stats = extractor.stats
+        embed = discord.Embed(title="Extraction Workers", color=discord.Color.blue())
+        embed.add_field(name="Pool", value=f"{extractor.max_workers} {'processes' if extractor.use_processes else 'threads'}", inline=True)
+        embed.add_field(name="Extractions", value=f"{stats['extractions']} ({stats['failures']} failed, {stats['timeouts']} timed out, {stats['coalesced']} joined)", inline=True)
+        embed.add_field(name="Worker Time", value=f"{stats['worker_seconds']:.1f}s", inline=True)
+        embed.add_field(name="Queue Wait", value=f"{stats['queue_wait_seconds']:.1f}s", inline=True)
+        embed.add_field(name="Loop Blocked", value=f"{stats['loop_blocked_seconds']:.3f}s (max stall {stats['max_loop_stall'] * 1000:.0f}ms)", inline=True)
+        
+        cache = extractor.cache.stats
+        lookups = cache['hits'] + cache['metadata_hits'] + cache['misses']
+        hit_rate = (cache['hits'] + cache['metadata_hits']) / lookups * 100 if lookups else 0
+        embed.add_field(
+            name="Cache",
+            value=(
+                f"{cache['entries']} entries, {cache['bytes'] / 1024:.0f}/{cache['max_bytes'] / 1024:.0f} KiB\n"
+                f"Hits: {cache['hits']} stream, {cache['metadata_hits']} metadata only\n"
+                f"Misses: {cache['misses']} | Evictions: {cache['evictions']} | Hit rate: {hit_rate:.0f}%"
+            ),
+            inline=False
+        )
+        
+        playback_lines = []
+        for mode, mode_stats in music_utils.playback_stats.items():
+            if not mode_stats['streams']:
+                continue
+            line = f"**{mode}**: {mode_stats['streams']} streams, {mode_stats['startup_seconds'] / mode_stats['streams'] * 1000:.0f}ms avg startup"
+            if mode_stats['cpu_streams']:
+                line += f", {mode_stats['cpu_seconds'] / mode_stats['cpu_streams']:.1f}s ffmpeg CPU per stream"
+            playback_lines.append(line)
+        embed.add_field(name="Playback", value="\n".join(playback_lines) or "No songs played yet", inline=False)
+        
+        audio_cache = music_utils.audio_cache
+        if audio_cache:
+            disk = audio_cache.stats
+            lookups = disk['hits'] + disk['misses']
+            embed.add_field(
+                name="Disk Cache",
+                value=(
+                    f"{audio_cache.files} files, {audio_cache.bytes / 1024 ** 2:.0f}/{audio_cache.max_bytes / 1024 ** 2:.0f} MiB\n"
+                    f"Hit rate: {disk['hits'] / lookups * 100 if lookups else 0:.0f}% ({disk['hits']} hits, {disk['misses']} misses)\n"
+                    f"Stored: {disk['stored']} | Failed: {disk['failed']} | Evictions: {disk['evictions']}"
+                ),
+                inline=False
+            )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+    
+    @app_commands.command(name="search_stats", description="Show YouTube search cache and quota usage")
+    @is_owner()
+    async def search_stats(self, interaction: discord.Interaction):
+        embed = discord.Embed(title="YouTube Search Quota", color=discord.Color.blue())
+        embed.add_field(name="Cached Queries", value=str(search_cache.entries), inline=False)
+        for day in [search_cache.today, *reversed(search_cache.history)]:
+            embed.add_field(
+                name=day['day'].isoformat(),
+                value=(
+                    f"Used: {day['units_used']} units ({day['requests']} requests)\n"
+                    f"Saved: {day['units_saved']} units ({day['hits']} cached, {day['coalesced']} coalesced)"
+                ),
+                inline=False
+            )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+    
     @app_commands.command(name="search", description="Search for YouTube videos")
     async def search(self, interaction: discord.Interaction, search_query: str):
         if self.youtube is None:
             await interaction.response.send_message("YouTube search is currently disabled. Please enable it first with /enable_youtube command.")
             return
         
-        response = music_utils.search_youtube(self.youtube, search_query, interaction.user.id)
+        await interaction.response.defer()
+        response = await music_utils.search_youtube(self.youtube, search_query, interaction.user.id)
         
         if not response or "items" not in response:
-            await interaction.response.send_message("No results found or an error occurred.")
+            await interaction.followup.send("No results found or an error occurred.")
             return
         
         message = "Top 5 results found:\n"
@@ -76,7 +264,7 @@ class Music(commands.Cog):
             message += f"{i}. {title}\n{url}\n\n"
         
         message += "To play a video, use the /play command with the number of the video (e.g., /play 1) or the full URL."
-        await interaction.response.send_message(message)
+        await interaction.followup.send(message)
     
     @app_commands.command(name="play", description="Play a YouTube video or add it to the playlist")
     @app_commands.describe(query="Enter a search query, video number from search results, or YouTube URL")
@@ -87,10 +275,9 @@ class Music(commands.Cog):
         
         await interaction.response.defer()
         
-        voice_client = interaction.guild.voice_client
-        if not voice_client:
-            voice_channel = interaction.user.voice.channel
-            voice_client = await voice_channel.connect()
+        player = music_utils.get_player(interaction.guild.id)
+        player.text_channel = interaction.channel
+        await player.connect(interaction.user.voice.channel)
         
         if query.isdigit() and 1 <= int(query) <= 5:
             last_search = music_utils.get_last_search(interaction.user.id)
@@ -105,39 +292,72 @@ class Music(commands.Cog):
                 await interaction.followup.send("YouTube search is currently disabled. Please enable it first with /enable_youtube command.")
                 return
             
-            search_response = music_utils.search_youtube(self.youtube, query, interaction.user.id)
+            search_response = await music_utils.search_youtube(self.youtube, query, interaction.user.id)
             if not search_response or "items" not in search_response:
                 await interaction.followup.send("No results found or an error occurred.")
                 return
             video_url = f"https://www.youtube.com/watch?v={search_response['items'][0]['id']['videoId']}"
         
-        ydl_opts = {
-            'format': 'bestaudio/best',
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'mp3',
-                'preferredquality': '192',
-            }],
-        }
-        
         try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(video_url, download=False)
-                title = info['title']
+            info = await extractor.resolve(video_url, interaction.guild.id, need_stream=False)
+            title = info['title']
             
-            music_utils.add_to_playlist(interaction.guild.id, video_url, title, interaction.user.name)
+            music_utils.add_to_playlist(interaction.guild.id, Track.from_url(video_url, title, interaction.user.id, info))
             
-            if not voice_client.is_playing():
-                await music_utils.play_next(self.bot, interaction.guild.id, interaction.channel)
+            if not player.is_active():
+                player.start()
                 await interaction.followup.send(f"Now playing: {title}\nAdded to server playlist by {interaction.user.name}")
             else:
                 await interaction.followup.send(f"Added to playlist: {title} (added by {interaction.user.name})")
         except Exception as e:
             await interaction.followup.send(f"An error occurred while trying to play/add the video: {str(e)}")
     
+    @app_commands.command(name="play_playlist", description="Add every video from a YouTube playlist to the server playlist")
+    @app_commands.describe(url="YouTube playlist URL")
+    async def play_playlist(self, interaction: discord.Interaction, url: str):
+        if interaction.user.voice is None:
+            await interaction.response.send_message("You need to be in a voice channel to use this command.")
+            return
+        
+        await interaction.response.defer()
+        
+        player = music_utils.get_player(interaction.guild.id)
+        player.text_channel = interaction.channel
+        await player.connect(interaction.user.voice.channel)
+        
+        try:
+            playlist_title, entries, total = await extractor.extract_playlist(url, interaction.guild.id, playlist_import_max)
+        except Exception as e:
+            await interaction.followup.send(f"An error occurred while reading the playlist: {str(e)}")
+            return
+        
+        if not entries:
+            await interaction.followup.send("No playable videos found in that playlist.")
+            return
+        
+        playlist_title = playlist_title or "playlist"
+        progress = await interaction.followup.send(f"Importing **{playlist_title}**: 0/{len(entries)} songs queued...", wait=True)
+        
+        # Tracks are queued unresolved; the player task and the prefetcher resolve them right before they play
+        for start in range(0, len(entries), PLAYLIST_IMPORT_BATCH):
+            for entry in entries[start:start + PLAYLIST_IMPORT_BATCH]:
+                music_utils.add_to_playlist(interaction.guild.id, Track.from_flat_entry(entry, interaction.user.id))
+            
+            if start == 0:
+                player.start()
+            
+            queued = min(start + PLAYLIST_IMPORT_BATCH, len(entries))
+            if queued < len(entries):
+                await progress.edit(content=f"Importing **{playlist_title}**: {queued}/{len(entries)} songs queued...")
+        
+        message = f"Added {len(entries)} songs from **{playlist_title}** to the server playlist (added by {interaction.user.name})"
+        if total > len(entries):
+            message += f"\nOnly the first {len(entries)} of {total} videos were imported (limit: {playlist_import_max})."
+        await progress.edit(content=message)
+    
     @app_commands.command(name="pause", description="Pause the currently playing audio")
     async def pause(self, interaction: discord.Interaction):
-        voice_client = get(self.bot.voice_clients, guild=interaction.guild)
+        voice_client = music_utils.get_player(interaction.guild.id).voice_client
         if voice_client and voice_client.is_playing():
             voice_client.pause()
             await interaction.response.send_message("Paused the audio.")
@@ -146,7 +366,7 @@ class Music(commands.Cog):
     
     @app_commands.command(name="resume", description="Resume paused audio")
     async def resume(self, interaction: discord.Interaction):
-        voice_client = get(self.bot.voice_clients, guild=interaction.guild)
+        voice_client = music_utils.get_player(interaction.guild.id).voice_client
         if voice_client and voice_client.is_paused():
             voice_client.resume()
             await interaction.response.send_message("Resumed the audio.")
@@ -155,11 +375,11 @@ class Music(commands.Cog):
     
     @app_commands.command(name="skip", description="Skip the current song")
     async def skip(self, interaction: discord.Interaction):
-        voice_client = interaction.guild.voice_client
+        voice_client = music_utils.get_player(interaction.guild.id).voice_client
         if voice_client and voice_client.is_playing():
             await interaction.response.defer()
             voice_client.stop()
-            # Note: play_next will be called automatically by the after callback
+            # Note: the player task moves on to the next song by itself
             await interaction.followup.send("Skipped the current song.")
         else:
             await interaction.response.send_message("No song is currently playing.")
@@ -173,50 +393,32 @@ class Music(commands.Cog):
             await interaction.response.send_message("The server playlist is empty.")
             return
         
-        message = ""
-        
-        # Show currently playing song
-        if current:
-            _, title, added_by = current
-            message += f"**Currently Playing:**\n{title} (added by {added_by})\n\n"
-        
-        # Show upcoming songs
-        if playlist:
-            message += "**Up Next:**\n"
-            for i, (url, title, added_by) in enumerate(playlist, start=1):
-                message += f"{i}. {title} (added by {added_by})\n<{url}>\n\n"
-        else:
-            message += "*No songs in queue*\n"
-        
-        # Show loop status
-        if music_utils.is_looping(interaction.guild.id):
-            message += "\n🔁 **Loop mode is ON**"
-        
-        await interaction.response.send_message(message)
+        view = PlaylistView(interaction.guild.id)
+        await interaction.response.send_message(embed=view.render(), view=view, allowed_mentions=discord.AllowedMentions.none())
+        view.message = await interaction.original_response()
     
     @app_commands.command(name="shuffle_playlist", description="Shuffle the server's playlist")
     async def shuffle_playlist(self, interaction: discord.Interaction):
         music_utils.shuffle_playlist(interaction.guild.id)
-        await interaction.response.send_message("The server playlist has been shuffled.")
-        playlist = music_utils.get_playlist(interaction.guild.id)
-        if playlist:
-            message = "Server playlist:\n"
-            for i, (url, title, added_by) in enumerate(playlist, start=1):
-                message += f"{i}. {title} (added by {added_by})\n<{url}>\n\n"
-            await interaction.channel.send(message)
+        if not music_utils.get_playlist(interaction.guild.id):
+            await interaction.response.send_message("The server playlist has been shuffled.")
+            return
+        view = PlaylistView(interaction.guild.id)
+        await interaction.response.send_message("The server playlist has been shuffled.", embed=view.render(), view=view, allowed_mentions=discord.AllowedMentions.none())
+        view.message = await interaction.original_response()
     
     @app_commands.command(name="remove_from_playlist", description="Remove a song from the server's playlist")
     @app_commands.describe(index="The number of the song to remove")
     async def remove_from_playlist(self, interaction: discord.Interaction, index: int):
         removed = music_utils.remove_from_playlist(interaction.guild.id, index - 1)
         if removed:
-            await interaction.response.send_message(f"Removed '{removed[1]}' from the server playlist.")
+            await interaction.response.send_message(f"Removed '{removed.title}' from the server playlist.")
         else:
             await interaction.response.send_message("Invalid index or the server playlist is empty.")
     
     @app_commands.command(name="clear_playlist", description="Clear the server's playlist")
     async def clear_playlist(self, interaction: discord.Interaction):
-        utils.clear_playlist(interaction.guild.id)
+        music_utils.clear_playlist(interaction.guild.id)
         await interaction.response.send_message("The server playlist has been cleared.")
     
     @app_commands.command(name="loop", description="Toggle looping of the current playlist")
@@ -231,15 +433,18 @@ class Music(commands.Cog):
     async def now_playing(self, interaction: discord.Interaction):
         current = music_utils.get_currently_playing(interaction.guild.id)
         if current:
-            url, title, added_by = current
-            voice_client = interaction.guild.voice_client
+            voice_client = music_utils.get_player(interaction.guild.id).voice_client
             status = "⏸️ Paused" if voice_client and voice_client.is_paused() else "▶️ Playing"
             
             embed = discord.Embed(
                 title="Now Playing",
-                description=f"{status}\n\n**{title}**\n\nAdded by: {added_by}\n[Link]({url})",
+                description=f"{status}\n\n**{current.title}**\n\nAdded by: {current.requester}\n[Link]({current.url})",
                 color=discord.Color.blue()
             )
+            if current.duration:
+                embed.add_field(name="Duration", value=format_duration(current.duration), inline=True)
+            if current.info and current.info.get('thumbnail'):
+                embed.set_thumbnail(url=current.info['thumbnail'])
             
             if music_utils.is_looping(interaction.guild.id):
                 embed.set_footer(text="🔁 Loop mode is ON")
@@ -250,17 +455,17 @@ class Music(commands.Cog):
     
     @app_commands.command(name="stop", description="Stop playing audio and disconnect")
     async def stop(self, interaction: discord.Interaction):
-        voice_client = get(self.bot.voice_clients, guild=interaction.guild)
-        if voice_client and voice_client.is_connected():
+        player = music_utils.get_player(interaction.guild.id)
+        if player.is_connected():
             # Stop playback
-            if voice_client.is_playing():
-                voice_client.stop()
+            if player.voice_client.is_playing():
+                player.voice_client.stop()
             
             # Clear playlist and state
             music_utils.clear_playlist(interaction.guild.id)
             
             # Disconnect
-            await voice_client.disconnect()
+            await player.disconnect()
             await interaction.response.send_message("Disconnected from voice channel and stopped playing.")
         else:
             await interaction.response.send_message("I'm not connected to a voice channel.")
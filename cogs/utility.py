@@ -103,6 +103,7 @@ class UtilityCog(commands.Cog):
         `/join` - Join your voice channel
         `/leave` - Leave the voice channel
         `/play <query>` - Play music from YouTube
+        `/play_playlist <url>` - Queue a whole YouTube playlist
         `/search <query>` - Search YouTube for videos
         `/pause` - Pause the current song
         `/resume` - Resume playback
@@ -117,6 +118,8 @@ class UtilityCog(commands.Cog):
         
         cobbleverse_commands = """
         `/cobbleverse_status` - Check Cobbleverse server status
+        `/cobbleverse_history [hours]` - Show server usage over time
+        `/cobbleverse_players` - List players currently online
         `/cobbleverse_info` - Show server information
         `/cobbleverse_start` - Start the server (Owner only)
         `/cobbleverse_stop` - Stop the server (Owner only)
@@ -1,10 +1,17 @@
 import discord
 from discord.ext import commands
 import os
-import bot_tasks
 from dotenv import load_dotenv
+
+# Load environment variables first: bot_tasks and utils read their settings on import
+load_dotenv()
+
+import bot_tasks
+from utils import perf_monitor
+from utils.command_metrics import MetricsCommandTree, MetricsServer, metrics
 import asyncio
 import logging
+import time
 import traceback
 from typing import Optional
 
@@ -15,8 +22,6 @@ logging.basicConfig(
 )
 logger = logging.getLogger('discord_bot')
 
-# Load environment variables
-load_dotenv()
 bot_token = os.getenv("BOT_TOKEN")
 
 # Bot setup
@@ -31,15 +36,25 @@ class DiscordBot(commands.Bot):
             command_prefix='!',
             intents=intents,
             help_command=None,
+            tree_cls=MetricsCommandTree,
             description="A versatile Discord bot with music and server management features"
         )
         self.initial_extensions = []
         self.failed_cogs = {}
+        self.metrics_server = MetricsServer.from_env(metrics)
         
     async def setup_hook(self):
         """Load all cogs and sync slash commands"""
         logger.info("Starting bot setup...")
         
+        # Watch the event loop from the start so slow cog loads show up too
+        perf_monitor.monitor.start()
+        if self.metrics_server:
+            try:
+                await self.metrics_server.start()
+            except OSError as e:
+                logger.error(f"Failed to start metrics server: {e}")
+        
         # Load all cogs from cogs directory
         cogs_dir = os.path.join(os.path.dirname(__file__), "cogs")
         
@@ -86,6 +101,12 @@ class DiscordBot(commands.Bot):
             logger.error(f"Failed to sync commands: {e}")
             raise
     
+    async def close(self):
+        perf_monitor.monitor.stop()
+        if self.metrics_server:
+            await self.metrics_server.close()
+        await super().close()
+    
     async def on_ready(self):
         """Called when the bot is ready"""
         logger.info(f"Bot is ready! Logged in as: {self.user.name} ({self.user.id})")
@@ -104,6 +125,10 @@ class DiscordBot(commands.Bot):
         except Exception as e:
             logger.error(f"Failed to start background tasks: {e}")
     
+    async def on_app_command_completion(self, interaction: discord.Interaction, command):
+        """Called after any slash command finishes without raising"""
+        metrics.record(interaction)
+    
     async def on_guild_join(self, guild: discord.Guild):
         """Called when the bot joins a new guild"""
         logger.info(f"Joined new guild: {guild.name} ({guild.id})")
@@ -295,6 +320,43 @@ class DeveloperCog(commands.Cog):
             await ctx.send(f"❌ Failed to sync commands: {e}")
             logger.error(f"Failed to sync commands: {e}")
     
+    @commands.command(name='perf')
+    async def perf_stats(self, ctx: commands.Context, action: Optional[str] = None):
+        """Show event loop lag and recent slow callbacks
+        
+        Usage:
+        !perf - Show the lag histogram and the latest slow callbacks
+        !perf reset - Clear the collected data
+        """
+        monitor = perf_monitor.monitor
+        if action == "reset":
+            monitor.reset()
+            await ctx.send("✅ Performance data cleared")
+            return
+        
+        embed = discord.Embed(
+            title="Event Loop Performance",
+            description=f"Sampled every {perf_monitor.format_seconds(monitor.interval)}, "
+                        f"slow above {perf_monitor.format_seconds(monitor.slow_threshold)}",
+            color=discord.Color.blue(),
+            timestamp=ctx.message.created_at
+        )
+        embed.add_field(name="Loop Lag", value=f"{monitor.lag.summary()}\n```{monitor.lag.render()}```", inline=False)
+        
+        slow = list(monitor.slow_callbacks)
+        embed.add_field(name="Slow Callbacks", value=f"{len(slow)} recorded", inline=False)
+        for record in reversed(slow[-3:]):
+            stack = record['stack'][-900:]
+            embed.add_field(
+                name=f"Blocked {perf_monitor.format_seconds(record['duration'])} at <t:{int(record['at'])}:T>",
+                value=f"```{stack}```",
+                inline=False
+            )
+        
+        if monitor.started_at:
+            embed.set_footer(text=f"Monitoring for {(time.time() - monitor.started_at) / 3600:.1f}h")
+        await ctx.send(embed=embed)
+    
     @commands.command(name='shutdown')
     async def shutdown_bot(self, ctx: commands.Context):
         """Gracefully shutdown the bot"""
@@ -310,6 +372,7 @@ bot = DiscordBot()
 async def on_app_command_error(interaction: discord.Interaction, error: discord.app_commands.AppCommandError):
     """Handle errors in slash commands"""
     logger.error(f"Application command error: {type(error).__name__}: {error}")
+    metrics.record(interaction, failed=True)
     
     if isinstance(error, discord.app_commands.CheckFailure):
         message = "You don't have permission to use this command."
@@ -0,0 +1,217 @@
+import asyncio
+import json
+import logging
+import os
+import shlex
+import time
+import zlib
+from collections import OrderedDict
+
+import cachetools
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = "index.json"
+OGG_MAGIC = b"OggS"
+
+
+def _file_crc32(path):
+    crc = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+
+class AudioDiskCache:
+    """Byte-budgeted LRU cache of Opus audio files on local disk.
+
+    Once a track has been played min_plays times, its stream is copied (no
+    re-encode) to <directory>/<video_id>.opus in the background while it plays.
+    Later plays hand that file straight to FFmpeg. Every file is recorded in
+    index.json with its size and CRC32; files that fail verification are dropped.
+    """
+
+    def __init__(self, directory, max_bytes, min_plays=1, max_downloads=2, before_options=''):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.min_plays = min_plays
+        self.before_options = before_options
+        self._entries = OrderedDict()
+        self._plays = cachetools.LRUCache(maxsize=10000)
+        self._downloads = {}
+        self._download_slots = asyncio.Semaphore(max_downloads)
+        self.bytes = 0
+        self.stats = {'hits': 0, 'misses': 0, 'stored': 0, 'failed': 0, 'evictions': 0}
+
+    @classmethod
+    def from_env(cls, before_options=''):
+        directory = os.getenv("MUSIC_DISK_CACHE_DIR")
+        if not directory:
+            return None
+        return cls(
+            directory,
+            max_bytes=int(os.getenv("MUSIC_DISK_CACHE_MAX_BYTES", str(2 * 1024 ** 3))),
+            min_plays=int(os.getenv("MUSIC_DISK_CACHE_MIN_PLAYS", "1")),
+            before_options=before_options,
+        )
+
+    @property
+    def files(self):
+        return len(self._entries)
+
+    def _path(self, video_id):
+        return os.path.join(self.directory, f"{video_id}.opus")
+
+    async def load(self):
+        """Read the index and drop anything missing, truncated or corrupt"""
+        entries = await asyncio.to_thread(self._load_index)
+        self._entries = OrderedDict(sorted(entries.items(), key=lambda item: item[1]['used']))
+        self.bytes = sum(entry['size'] for entry in self._entries.values())
+        await self._evict()
+
+    def _load_index(self):
+        os.makedirs(self.directory, exist_ok=True)
+        for name in os.listdir(self.directory):
+            if name.endswith(".part"):
+                os.remove(os.path.join(self.directory, name))
+        try:
+            with open(os.path.join(self.directory, INDEX_FILE)) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+
+        valid = {}
+        for video_id, entry in index.items():
+            path = self._path(video_id)
+            try:
+                if os.path.getsize(path) == entry['size'] and _file_crc32(path) == entry['crc32']:
+                    valid[video_id] = entry
+                    continue
+            except OSError:
+                pass
+            logger.warning(f"Dropping corrupt audio cache entry {video_id}")
+            self._remove_file(path)
+        return valid
+
+    def _save_index(self):
+        path = os.path.join(self.directory, INDEX_FILE)
+        with open(path + ".part", 'w') as f:
+            json.dump(dict(self._entries), f)
+        os.replace(path + ".part", path)
+
+    @staticmethod
+    def _remove_file(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def lookup(self, video_id):
+        """Path of the cached file for video_id, or None"""
+        entry = self._entries.get(video_id)
+        path = self._path(video_id)
+        if entry is None:
+            self.stats['misses'] += 1
+            return None
+        try:
+            # Cheap check on every hit; the full CRC runs when the index is loaded
+            valid = os.path.getsize(path) == entry['size']
+            if valid:
+                with open(path, 'rb') as f:
+                    valid = f.read(4) == OGG_MAGIC
+        except OSError:
+            valid = False
+        if not valid:
+            self._forget(video_id)
+            self.stats['misses'] += 1
+            return None
+        self._entries.move_to_end(video_id)
+        entry['used'] = time.time()
+        self.stats['hits'] += 1
+        return path
+
+    def note_play(self, video_id, stream_url, duration=None):
+        """Count a streamed play and start copying the stream once the track is hot enough"""
+        plays = self._plays.get(video_id, 0) + 1
+        self._plays[video_id] = plays
+        if plays >= self.min_plays and video_id not in self._entries and video_id not in self._downloads:
+            self._downloads[video_id] = asyncio.create_task(self._store(video_id, stream_url, duration))
+
+    async def _store(self, video_id, stream_url, duration):
+        path = self._path(video_id)
+        part = path + ".part"
+        # Generous enough for streams that YouTube throttles to real time
+        timeout = max(300, (duration or 0) * 2)
+        try:
+            async with self._download_slots:
+                process = await asyncio.create_subprocess_exec(
+                    'ffmpeg', '-nostdin', '-loglevel', 'error',
+                    *shlex.split(self.before_options),
+                    '-i', stream_url, '-vn', '-map_metadata', '-1', '-c:a', 'copy', '-f', 'opus', '-y', part,
+                    stdout=asyncio.subprocess.DEVNULL,
+                    stderr=asyncio.subprocess.PIPE
+                )
+                try:
+                    _, stderr = await asyncio.wait_for(process.communicate(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    await self._kill(process)
+                    raise RuntimeError(f"ffmpeg did not finish within {timeout:g}s")
+                except asyncio.CancelledError:
+                    # close() while downloading: don't leave ffmpeg writing to the part file
+                    await self._kill(process)
+                    raise
+                if process.returncode != 0:
+                    raise RuntimeError(f"ffmpeg exited with {process.returncode}: {stderr.decode(errors='replace').strip()}")
+
+            size, crc = await asyncio.to_thread(self._finalize, part, path)
+            self._entries[video_id] = {'size': size, 'crc32': crc, 'used': time.time()}
+            self.bytes += size
+            self.stats['stored'] += 1
+            await self._evict()
+        except Exception as e:
+            self.stats['failed'] += 1
+            logger.warning(f"Could not cache audio for {video_id}: {e}")
+            self._remove_file(part)
+        except asyncio.CancelledError:
+            self._remove_file(part)
+            raise
+        finally:
+            self._downloads.pop(video_id, None)
+
+    @staticmethod
+    async def _kill(process):
+        if process.returncode is None:
+            process.kill()
+        await process.wait()
+
+    @staticmethod
+    def _finalize(part, path):
+        with open(part, 'rb') as f:
+            if f.read(4) != OGG_MAGIC:
+                raise RuntimeError("output is not an Ogg file")
+        size = os.path.getsize(part)
+        crc = _file_crc32(part)
+        os.replace(part, path)
+        return size, crc
+
+    def _forget(self, video_id):
+        entry = self._entries.pop(video_id, None)
+        if entry is not None:
+            self.bytes -= entry['size']
+            self._remove_file(self._path(video_id))
+
+    async def _evict(self):
+        while self.bytes > self.max_bytes and self._entries:
+            video_id = next(iter(self._entries))
+            self._forget(video_id)
+            self.stats['evictions'] += 1
+        await asyncio.to_thread(self._save_index)
+
+    async def close(self):
+        tasks = list(self._downloads.values())
+        for task in tasks:
+            task.cancel()
+        # Let them kill ffmpeg and remove their part files before the cog goes away
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._downloads.clear()
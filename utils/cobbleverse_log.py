@@ -0,0 +1,143 @@
+import asyncio
+import logging
+import os
+import re
+import time
+from collections import deque, namedtuple
+
+logger = logging.getLogger(__name__)
+
+LogEvent = namedtuple('LogEvent', ['kind', 'player', 'text', 'at'])
+
+# "[12:34:56] [Server thread/INFO]: message", optionally with a mod logger tag before the colon
+LOG_LINE = re.compile(r"^\[(\d\d):(\d\d):(\d\d)\] \[[^\]]+/INFO\](?: \[[^\]]+\])?: (.*)$")
+JOINED = re.compile(r"^(\w{1,16}) joined the game$")
+LEFT = re.compile(r"^(\w{1,16}) left the game$")
+CHAT = re.compile(r"^(?:\[Not Secure\] )?<(\w{1,16})> (.*)$")
+SERVER_STARTED = re.compile(r"^Done \([\d.]+s\)!")
+SERVER_STOPPING = re.compile(r"^Stopping server$")
+# Vanilla death messages all start with the player's name followed by one of these
+DEATH_PHRASES = (
+    "was ", "drowned", "died", "fell ", "blew up", "burned to death", "hit the ground", "tried to swim in lava",
+    "starved to death", "suffocated", "withered away", "froze to death", "went up in flames", "went off with a bang",
+    "walked into", "experienced kinetic energy", "discovered the floor was lava", "didn't want to live",
+    "left the confines of this world", "fell out of the world", "is no more",
+)
+
+
+def _line_time(hours, minutes, seconds):
+    """Timestamp for a log line's HH:MM:SS, assuming it is the most recent such time"""
+    now = time.time()
+    local = time.localtime(now)
+    at = time.mktime(local[:3] + (int(hours), int(minutes), int(seconds)) + local[6:])
+    return at - 86400 if at > now + 60 else at
+
+
+class LogFollower:
+    """Follows the server's latest.log by offset and turns new lines into events.
+
+    The file is polled every poll_interval seconds; a new inode or a file shorter
+    than the current offset means the log was rotated, so reading restarts from
+    the top. Events wait in `pending` (bounded) until drain() is called, and
+    `online` tracks who is currently connected.
+    """
+
+    def __init__(self, path, poll_interval=1.0, max_pending=500):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.online = {}
+        self.pending = deque(maxlen=max_pending)
+        self.dropped = 0
+        self.started_at = None
+        self._inode = None
+        self._offset = 0
+        self._partial = b""
+        self._task = None
+
+    @classmethod
+    def from_env(cls, server_dir):
+        return cls(
+            os.getenv("COBBLEVERSE_LOG_PATH", os.path.join(server_dir, "serverfiles", "logs", "latest.log")),
+            poll_interval=float(os.getenv("COBBLEVERSE_LOG_POLL_INTERVAL", "1")),
+        )
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def drain(self):
+        events = list(self.pending)
+        self.pending.clear()
+        return events
+
+    async def _run(self):
+        # Replay what is already in the log without emitting events, so `online` starts out right
+        try:
+            for line in await asyncio.to_thread(self._read_new):
+                self._handle(line, emit=False)
+        except OSError:
+            pass
+        self.started_at = time.time()
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                lines = self._read_new() if self._has_new_data() else []
+            except OSError as e:
+                logger.debug(f"Cannot read {self.path}: {e}")
+                continue
+            for line in lines:
+                self._handle(line)
+
+    def _has_new_data(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        return stat.st_ino != self._inode or stat.st_size != self._offset
+
+    def _read_new(self):
+        with open(self.path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            if stat.st_ino != self._inode or stat.st_size < self._offset:
+                # Rotated or truncated: whatever was half-read belongs to the old file
+                self._inode, self._offset, self._partial = stat.st_ino, 0, b""
+            f.seek(self._offset)
+            data = f.read()
+        self._offset += len(data)
+        *lines, self._partial = (self._partial + data).split(b"\n")
+        return [line.decode('utf-8', errors='replace').rstrip("\r") for line in lines]
+
+    def _handle(self, line, emit=True):
+        line_match = LOG_LINE.match(line)
+        if not line_match:
+            return
+        message = line_match.group(4)
+        now = _line_time(*line_match.group(1, 2, 3))
+
+        if match := JOINED.match(message):
+            self.online[match.group(1)] = now
+            event = LogEvent('join', match.group(1), message, now)
+        elif match := LEFT.match(message):
+            self.online.pop(match.group(1), None)
+            event = LogEvent('leave', match.group(1), message, now)
+        elif match := CHAT.match(message):
+            event = LogEvent('chat', match.group(1), match.group(2), now)
+        elif SERVER_STARTED.match(message) or SERVER_STOPPING.match(message):
+            self.online.clear()
+            event = LogEvent('server', None, "Server started" if message.startswith("Done") else "Server stopping", now)
+        else:
+            # Only online players can die, which keeps arbitrary mod output from looking like a death
+            player, _, rest = message.partition(" ")
+            if player not in self.online or not rest.startswith(DEATH_PHRASES):
+                return
+            event = LogEvent('death', player, message, now)
+
+        if emit:
+            if len(self.pending) == self.pending.maxlen:
+                self.dropped += 1
+            self.pending.append(event)
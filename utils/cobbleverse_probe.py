@@ -0,0 +1,151 @@
+import asyncio
+import json
+import os
+import struct
+import time
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+def _read_stat(pid):
+    """(start time in ticks, utime + stime in ticks) from /proc/<pid>/stat"""
+    with open(f"/proc/{pid}/stat") as f:
+        # The command name may contain spaces, so split after its closing parenthesis
+        fields = f.read().rsplit(")", 1)[1].split()
+    return int(fields[19]), int(fields[11]) + int(fields[12])
+
+
+def _boot_time():
+    with open("/proc/stat") as f:
+        for line in f:
+            if line.startswith("btime"):
+                return int(line.split()[1])
+    raise OSError("btime missing from /proc/stat")
+
+
+def _mem_total():
+    with open("/proc/meminfo") as f:
+        for line in f:
+            if line.startswith("MemTotal:"):
+                return int(line.split()[1]) * 1024
+    raise OSError("MemTotal missing from /proc/meminfo")
+
+
+class JavaProcess:
+    """Finds the server's Java process once and reads its CPU and RSS straight from /proc.
+
+    The PID is re-validated on every read against the process start time, so
+    a recycled PID is never mistaken for the server.
+    """
+
+    def __init__(self, server_dir):
+        self.server_dir = os.path.realpath(server_dir)
+        self.pid = None
+        self._started = None
+        self._last_cpu = None
+
+    def _matches(self, pid):
+        with open(f"/proc/{pid}/cmdline", 'rb') as f:
+            args = f.read().split(b"\0")
+        if not os.path.basename(args[0]).startswith(b"java"):
+            return False
+        if any(self.server_dir.encode() in arg for arg in args):
+            return True
+        return os.path.realpath(f"/proc/{pid}/cwd").startswith(self.server_dir)
+
+    def discover(self):
+        """Scan /proc for the server; returns the PID or None"""
+        self.pid = self._started = self._last_cpu = None
+        for name in os.listdir("/proc"):
+            if not name.isdigit():
+                continue
+            try:
+                if self._matches(int(name)):
+                    self.pid = int(name)
+                    self._started, _ = _read_stat(self.pid)
+                    return self.pid
+            except OSError:
+                # Exited mid-scan or belongs to another user
+                continue
+        return None
+
+    def is_valid(self):
+        if self.pid is None:
+            return False
+        try:
+            started, _ = _read_stat(self.pid)
+        except OSError:
+            return False
+        return started == self._started
+
+    def sample(self):
+        """(cpu percent of one core, memory percent of the host) or None if the process is gone"""
+        if not self.is_valid():
+            return None
+        try:
+            _, cpu_ticks = _read_stat(self.pid)
+            with open(f"/proc/{self.pid}/statm") as f:
+                rss = int(f.read().split()[1]) * PAGE_SIZE
+        except OSError:
+            return None
+
+        now = time.monotonic()
+        if self._last_cpu is not None:
+            last_ticks, last_time = self._last_cpu
+            cpu = (cpu_ticks - last_ticks) / CLOCK_TICKS / max(now - last_time, 1e-6) * 100
+        else:
+            # First reading: lifetime average, which is what ps reports
+            uptime = time.time() - (_boot_time() + self._started / CLOCK_TICKS)
+            cpu = cpu_ticks / CLOCK_TICKS / max(uptime, 1e-6) * 100
+        self._last_cpu = (cpu_ticks, now)
+        return round(cpu, 1), round(rss / _mem_total() * 100, 1)
+
+
+def _varint(value):
+    out = bytearray()
+    value &= 0xFFFFFFFF
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+async def _read_varint(reader):
+    value = 0
+    for shift in range(0, 35, 7):
+        byte = (await reader.readexactly(1))[0]
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value
+    raise ValueError("VarInt is too long")
+
+
+def _packet(packet_id, payload=b""):
+    body = _varint(packet_id) + payload
+    return _varint(len(body)) + body
+
+
+async def server_list_ping(host, port, timeout=3.0):
+    """Ask a Minecraft server for its status JSON using the server list ping protocol"""
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    try:
+        address = host.encode()
+        handshake = _varint(-1) + _varint(len(address)) + address + struct.pack(">H", port) + _varint(1)
+        writer.write(_packet(0x00, handshake) + _packet(0x00))
+        await writer.drain()
+
+        async def read_status():
+            await _read_varint(reader)
+            if await _read_varint(reader) != 0x00:
+                raise ValueError("unexpected packet in status response")
+            length = await _read_varint(reader)
+            return json.loads(await reader.readexactly(length))
+
+        return await asyncio.wait_for(read_status(), timeout)
+    finally:
+        writer.close()
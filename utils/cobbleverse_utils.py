@@ -1,75 +1,385 @@
-import subprocess
 import re
 import asyncio
+import enum
+import logging
+import math
+import os
+import signal
+import time
+from array import array
+
+from utils.cobbleverse_log import LogFollower
+from utils.cobbleverse_probe import JavaProcess, server_list_ping
+
+logger = logging.getLogger(__name__)
+
+
+MCSERVER = "/home/tempeste/Drive2_symlink/cobbleverse/mcserver"
+# "linuxgsm" runs `mcserver details`; "fast" reads /proc and pings the server, falling back to LinuxGSM
+PROBE = os.getenv("COBBLEVERSE_PROBE", "linuxgsm").lower()
+SERVER_HOST = os.getenv("COBBLEVERSE_HOST", "127.0.0.1")
+SERVER_PORT = int(os.getenv("COBBLEVERSE_PORT", "25565"))
+
+java_process = JavaProcess(os.path.dirname(MCSERVER))
+log_follower = LogFollower.from_env(os.path.dirname(MCSERVER))
+
+ANSI_ESCAPE = re.compile(r'\x1B[@-_][0-?]*[ -/]*[@-~]')
+# One pass per line: every field we read from `mcserver details` is a "Key: value" line
+DETAILS_FIELD = re.compile(r"^\s*(Internet IP|CPU Used|Mem Used|Status|Players|Maxplayers):\s*(.*?)\s*$")
+NUMBER = re.compile(r"\d+(?:\.\d+)?")
+DETAILS_TIMEOUT = float(os.getenv("COBBLEVERSE_DETAILS_TIMEOUT", "30"))
+
+
+class ServerStatus(enum.Enum):
+    STARTED = "STARTED"
+    # The Java process is up but not answering pings yet (only reported by the fast probe)
+    STARTING = "STARTING"
+    STOPPED = "STOPPED"
+    ERROR = "ERROR"
+    UNKNOWN = "UNKNOWN"
+
+    @classmethod
+    def parse(cls, text):
+        try:
+            return cls(text.upper())
+        except ValueError:
+            return cls.UNKNOWN
+
+
+class ServerSnapshot:
+    """One parsed `mcserver details` run; numeric fields are None when LinuxGSM didn't report them"""
+
+    __slots__ = ('status', 'ip', 'cpu_percent', 'mem_percent', 'players', 'max_players', 'error')
+
+    def __init__(self, status=ServerStatus.UNKNOWN, ip=None, cpu_percent=None, mem_percent=None,
+                 players=None, max_players=None, error=None):
+        self.status = status
+        self.ip = ip
+        self.cpu_percent = cpu_percent
+        self.mem_percent = mem_percent
+        self.players = players
+        self.max_players = max_players
+        self.error = error
+
+    @property
+    def online(self):
+        return self.status is ServerStatus.STARTED
+
+    def feed(self, line):
+        """Parse one line of details output into the snapshot"""
+        match = DETAILS_FIELD.match(ANSI_ESCAPE.sub('', line))
+        if not match:
+            return
+        key, value = match.groups()
+        if key == "Internet IP":
+            self.ip = value.rsplit(":", 1)[0]
+        elif key == "Status":
+            # Only the first Status line describes the server itself
+            if self.status is ServerStatus.UNKNOWN:
+                self.status = ServerStatus.parse(value.split()[0] if value else "")
+        elif key == "Players":
+            numbers = NUMBER.findall(value)
+            if numbers:
+                self.players = int(float(numbers[0]))
+            if len(numbers) > 1:
+                self.max_players = int(float(numbers[1]))
+        else:
+            number = NUMBER.search(value)
+            number = float(number.group()) if number else None
+            if key == "CPU Used":
+                self.cpu_percent = number
+            elif key == "Mem Used":
+                self.mem_percent = number
+            elif number is not None:
+                self.max_players = int(number)
+
+    def __repr__(self):
+        return f"ServerSnapshot({self.status.value}, cpu={self.cpu_percent}, mem={self.mem_percent}, players={self.players})"
+
+
+def format_percent(value):
+    return f"{value:g}%" if value is not None else "N/A"
 
 
 async def check_cobbleverse_server():
+    if PROBE == "fast":
+        try:
+            return await probe_cobbleverse_server()
+        except Exception as e:
+            logger.warning(f"Fast probe failed, falling back to LinuxGSM: {e}")
+    return await check_linuxgsm_details()
+
+async def probe_cobbleverse_server():
+    """Status from /proc and a server list ping, without running LinuxGSM"""
+    if not java_process.is_valid():
+        # Scanning /proc touches every process, so keep it off the event loop
+        await asyncio.to_thread(java_process.discover)
+    usage = java_process.sample()
+
+    try:
+        ping = await server_list_ping(SERVER_HOST, SERVER_PORT)
+    except (OSError, asyncio.TimeoutError, ValueError, asyncio.IncompleteReadError):
+        ping = None
+
+    if ping is not None:
+        status = ServerStatus.STARTED
+    elif usage is not None:
+        status = ServerStatus.STARTING
+    else:
+        status = ServerStatus.STOPPED
+    players = (ping or {}).get('players', {})
+    return ServerSnapshot(
+        status,
+        cpu_percent=usage[0] if usage else None,
+        mem_percent=usage[1] if usage else None,
+        players=players.get('online'),
+        max_players=players.get('max'),
+    )
+
+async def check_linuxgsm_details(timeout=DETAILS_TIMEOUT):
     try:
-        command = "/home/tempeste/Drive2_symlink/cobbleverse/mcserver details"
-        process = await asyncio.create_subprocess_shell(
-            command,
+        process = await asyncio.create_subprocess_exec(
+            MCSERVER, "details",
             stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
+            stderr=asyncio.subprocess.PIPE,
+            # Own process group, so a hung run can be killed along with LinuxGSM's helpers
+            start_new_session=True
         )
-        stdout, stderr = await process.communicate()
-        status_output = stdout.decode('utf-8')
-        stderr_output = stderr.decode('utf-8')
-
-        # If the command failed but we got output in stderr
-        if process.returncode != 0:
-            return (
-                "Error", 
-                "N/A", 
-                "N/A", 
-                "STOPPED" if "not running" in stderr_output.lower() else "ERROR"
-            )
-
-        # Remove ANSI escape codes for more reliable regex matching
-        ansi_escape = re.compile(r'\x1B[@-_][0-?]*[ -/]*[@-~]')
-        cleaned_output = ansi_escape.sub('', status_output)
-
-        # Extracting the sections
-        internet_ip = re.search(r"Internet IP:\s*(.+?):\d+", cleaned_output)
-        cpu_usage = re.search(r"CPU Used:\s*(.+?)%", cleaned_output)
-        mem_usage = re.search(r"Mem Used:\s*(.+)%", cleaned_output)
-        server_status_search = re.search(r"Status:\s*(\w+)", cleaned_output)
-
-        internet_ip = internet_ip.group(1) if internet_ip else "Not Found"
-        cpu_usage = f"CPU Used: {cpu_usage.group(1)}%" if cpu_usage else "Not Found"
-        mem_usage = f"Mem Used: {mem_usage.group(1)}%" if mem_usage else "Not Found"
-        server_status = server_status_search.group(1) if server_status_search else "Not Found"
-
-        return internet_ip, cpu_usage, mem_usage, server_status
-
     except Exception as e:
-        return f"Error: {str(e)}", "N/A", "N/A", "ERROR"
+        return ServerSnapshot(ServerStatus.ERROR, error=str(e))
+
+    # Drain stderr alongside stdout so neither pipe can fill up and stall the script
+    stderr_task = asyncio.create_task(process.stderr.read())
+    snapshot = ServerSnapshot()
 
-async def start_cobbleverse_server():
-    command = "/home/tempeste/Drive2_symlink/cobbleverse/mcserver start"
-    process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    async def read():
+        async for line in process.stdout:
+            snapshot.feed(line.decode('utf-8', errors='replace'))
+        stderr = await stderr_task
+        await process.wait()
+        return stderr
 
     try:
-        stdout, stderr = await asyncio.wait_for(asyncio.to_thread(process.communicate), timeout=120)  # Timeout in seconds
-        return process.returncode, stdout, stderr
+        stderr_output = (await asyncio.wait_for(read(), timeout=timeout)).decode('utf-8', errors='replace')
     except asyncio.TimeoutError:
-        return None, None, "Timeout"
-    
-async def stop_cobbleverse_server():
-    command = "/home/tempeste/Drive2_symlink/cobbleverse/mcserver stop"
-    process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        await _kill_details(process, stderr_task)
+        return ServerSnapshot(ServerStatus.ERROR, error=f"mcserver details timed out after {timeout:g}s")
+    except Exception as e:
+        # e.g. ValueError from a line longer than the stream limit
+        await _kill_details(process, stderr_task)
+        return ServerSnapshot(ServerStatus.ERROR, error=str(e))
+
+    # If the command failed but we got output in stderr
+    if process.returncode != 0:
+        not_running = "not running" in stderr_output.lower()
+        return ServerSnapshot(
+            ServerStatus.STOPPED if not_running else ServerStatus.ERROR,
+            error=None if not_running else (stderr_output.strip() or f"mcserver exited with {process.returncode}")
+        )
+    return snapshot
+
+async def _kill_details(process, stderr_task):
+    stderr_task.cancel()
+    _signal_group(process, signal.SIGKILL)
+    await process.wait()
+
+
+class SampleHistory:
+    """Fixed-size ring of status samples, one packed array('d') per metric.
+
+    Missing values are stored as NaN and skipped by summarize().
+    """
+
+    METRICS = ('cpu_percent', 'mem_percent', 'players', 'online')
 
+    def __init__(self, capacity=1440):
+        self.capacity = capacity
+        self.times = array('d', [0.0]) * capacity
+        self.values = {metric: array('d', [math.nan]) * capacity for metric in self.METRICS}
+        self.count = 0
+        self._next = 0
+
+    def append(self, timestamp, snapshot):
+        i = self._next
+        self.times[i] = timestamp
+        for metric in self.METRICS:
+            value = getattr(snapshot, metric)
+            self.values[metric][i] = math.nan if value is None else float(value)
+        self._next = (i + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def summarize(self, since):
+        """(samples, {metric: (min, avg, max) or None}) for samples taken at or after since"""
+        indices = [i for i in range(self.count) if self.times[i] >= since]
+        summary = {}
+        for metric in self.METRICS:
+            column = self.values[metric]
+            present = [column[i] for i in indices if not math.isnan(column[i])]
+            summary[metric] = (min(present), sum(present) / len(present), max(present)) if present else None
+        return len(indices), summary
+
+
+class StatusSampler:
+    """Keeps the latest check_cobbleverse_server() result so readers never wait on LinuxGSM.
+
+    A background task refreshes the sample every refresh_interval seconds.
+    Concurrent refreshes share one `mcserver details` run instead of spawning
+    one each.
+    """
+
+    def __init__(self, refresh_interval=600.0, history_samples=1440):
+        self.refresh_interval = refresh_interval
+        self.history = SampleHistory(history_samples)
+        self.status = None
+        self.sampled_at = None
+        self._refreshing = None
+        self._task = None
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            # Each sample spawns `mcserver details`; the presence loop asks for fresher ones during transitions
+            refresh_interval=float(os.getenv("COBBLEVERSE_REFRESH_INTERVAL", "600")),
+            history_samples=int(os.getenv("COBBLEVERSE_HISTORY_SAMPLES", "1440")),
+        )
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def age(self):
+        return time.time() - self.sampled_at if self.sampled_at else None
+
+    async def _run(self):
+        while True:
+            # A sample taken on demand in the meantime pushes the next one back
+            age = self.age()
+            if age is not None and age < self.refresh_interval:
+                await asyncio.sleep(self.refresh_interval - age)
+                continue
+            try:
+                await self.refresh()
+            except Exception:
+                # Already logged by _sampled()
+                await asyncio.sleep(self.refresh_interval)
+
+    async def _sample(self):
+        status = await check_cobbleverse_server()
+        self.status, self.sampled_at = status, time.time()
+        if status.error is None:
+            self.history.append(self.sampled_at, status)
+        return status
+
+    def refresh_soon(self):
+        """Start a new sample in the background unless one is already running; returns its task"""
+        if self._refreshing is None or self._refreshing.done():
+            self._refreshing = asyncio.create_task(self._sample())
+            self._refreshing.add_done_callback(self._sampled)
+        return self._refreshing
+
+    @staticmethod
+    def _sampled(task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Cobbleverse status refresh failed: {task.exception()}")
+
+    async def refresh(self):
+        """Take a new sample, joining the one already running if there is one"""
+        self.refresh_soon()
+        # Shielded so one caller giving up doesn't cancel the sample for everyone else
+        return await asyncio.shield(self._refreshing)
+
+    async def get(self, max_age=None):
+        """Return (status, sampled_at), only sampling if the cached one is missing or older than max_age"""
+        if max_age is None:
+            max_age = self.refresh_interval * 2
+        age = self.age()
+        if age is None or age > max_age:
+            await self.refresh()
+        return self.status, self.sampled_at
+
+
+sampler = StatusSampler.from_env()
+
+# Only one start/stop/restart may run at a time; callers take it before running one
+lifecycle_lock = asyncio.Lock()
+# Called with the action name as each start/stop/restart begins
+lifecycle_listeners = []
+LIFECYCLE_TIMEOUT = float(os.getenv("COBBLEVERSE_LIFECYCLE_TIMEOUT", "120"))
+# How long the script gets to exit after SIGTERM before the whole group is killed
+KILL_GRACE = 5
+
+
+def _signal_group(process, sig):
     try:
-        stdout, stderr = await asyncio.wait_for(asyncio.to_thread(process.communicate), timeout=120)  # Timeout in seconds
-        return process.returncode, stdout, stderr
-    except asyncio.TimeoutError:
-        return None, None, "Timeout"
+        os.killpg(process.pid, sig)
+    except ProcessLookupError:
+        pass
+
+async def run_mcserver(action, on_output=None, timeout=LIFECYCLE_TIMEOUT):
+    """Run `mcserver <action>`, passing each cleaned output line to on_output as it arrives.
+
+    Returns (returncode, output); returncode is None if the command timed out, in
+    which case its whole process group has been terminated.
+    """
+    process = await asyncio.create_subprocess_exec(
+        MCSERVER, action,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT,
+        # Own process group, so a timeout can take LinuxGSM's helpers down with it
+        start_new_session=True
+    )
+    lines = []
 
-async def restart_cobbleverse_server():
-    command = "/home/tempeste/Drive2_symlink/cobbleverse/mcserver restart"
-    process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    async def pump():
+        async for raw in process.stdout:
+            # LinuxGSM redraws progress lines with carriage returns; keep the final state
+            line = ANSI_ESCAPE.sub('', raw.decode('utf-8', errors='replace')).rstrip().rsplit("\r", 1)[-1]
+            if not line:
+                continue
+            lines.append(line)
+            if on_output is not None:
+                on_output(line)
+        return await process.wait()
 
     try:
-        stdout, stderr = await asyncio.wait_for(asyncio.to_thread(process.communicate), timeout=120)  # Timeout in seconds
-        return process.returncode, stdout, stderr
+        returncode = await asyncio.wait_for(pump(), timeout=timeout)
     except asyncio.TimeoutError:
-        return None, None, "Timeout"
\ No newline at end of file
+        await _terminate_group(process)
+        returncode = None
+    except BaseException:
+        # A line over the stream limit (ValueError) or a cancelled command: don't leave LinuxGSM running
+        await _terminate_group(process)
+        raise
+    return returncode, "\n".join(lines)
+
+async def _terminate_group(process):
+    _signal_group(process, signal.SIGTERM)
+    try:
+        await asyncio.wait_for(process.wait(), timeout=KILL_GRACE)
+    except asyncio.TimeoutError:
+        _signal_group(process, signal.SIGKILL)
+        await process.wait()
+
+async def _lifecycle(action, on_output):
+    """Run a lifecycle action; the caller must already hold lifecycle_lock"""
+    for listener in lifecycle_listeners:
+        listener(action)
+    try:
+        return await run_mcserver(action, on_output)
+    finally:
+        # Whatever happened, the cached status is now out of date
+        sampler.refresh_soon()
+
+async def start_cobbleverse_server(on_output=None):
+    return await _lifecycle("start", on_output)
+
+async def stop_cobbleverse_server(on_output=None):
+    return await _lifecycle("stop", on_output)
+
+async def restart_cobbleverse_server(on_output=None):
+    return await _lifecycle("restart", on_output)
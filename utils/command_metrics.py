@@ -0,0 +1,203 @@
+import logging
+import os
+import time
+
+import cachetools
+import discord
+from aiohttp import web
+from discord import app_commands
+
+from utils import perf_monitor
+from utils.perf_monitor import Histogram
+
+logger = logging.getLogger(__name__)
+
+
+class CommandStats:
+    __slots__ = ('invocations', 'errors', 'defer', 'handler')
+
+    def __init__(self):
+        self.invocations = 0
+        self.errors = 0
+        self.defer = Histogram()
+        self.handler = Histogram()
+
+    def record(self, defer_seconds, handler_seconds, failed):
+        self.invocations += 1
+        if failed:
+            self.errors += 1
+        if defer_seconds is not None:
+            self.defer.record(defer_seconds)
+        self.handler.record(handler_seconds)
+
+
+class CommandMetrics:
+    """Invocation counts, errors and latency histograms per app command and per (command, guild).
+
+    Every series has a fixed size, and the per-guild series are kept in an LRU
+    capped at max_guild_series, so memory stays bounded however many guilds
+    use the bot.
+    """
+
+    def __init__(self, max_guild_series=2000):
+        self.commands = {}
+        self.guilds = cachetools.LRUCache(maxsize=max_guild_series)
+
+    def record(self, interaction, failed=False):
+        started_at = interaction.extras.get('metrics_started_at')
+        if started_at is None:
+            # Never went through the tree's interaction_check, e.g. an unknown command
+            return
+        command = interaction.command.qualified_name if interaction.command else "unknown"
+        now = time.perf_counter()
+        responded_at = getattr(interaction.response, 'responded_at', None)
+        defer_seconds = responded_at - started_at if responded_at is not None else None
+
+        stats = self.commands.get(command)
+        if stats is None:
+            stats = self.commands[command] = CommandStats()
+        stats.record(defer_seconds, now - started_at, failed)
+
+        key = (command, interaction.guild_id or 0)
+        guild_stats = self.guilds.get(key)
+        if guild_stats is None:
+            guild_stats = self.guilds[key] = CommandStats()
+        guild_stats.record(defer_seconds, now - started_at, failed)
+
+    def render_prometheus(self):
+        """All series in the Prometheus text exposition format"""
+        lines = []
+        per_command = [({'command': command}, stats) for command, stats in sorted(self.commands.items())]
+        per_guild = [
+            ({'command': command, 'guild': str(guild_id)}, stats)
+            for (command, guild_id), stats in sorted(self.guilds.items())
+        ]
+        for prefix, series in (("discord_app_command", per_command), ("discord_app_command_guild", per_guild)):
+            _counter(lines, f"{prefix}_invocations_total", "App command invocations", series, 'invocations')
+            _counter(lines, f"{prefix}_errors_total", "App command invocations that raised", series, 'errors')
+            _histogram(lines, f"{prefix}_defer_seconds", "Time until the interaction was first responded to or deferred", series, 'defer')
+            _histogram(lines, f"{prefix}_handler_seconds", "Total app command handler time", series, 'handler')
+        _histogram(lines, "discord_bot_event_loop_lag_seconds", "Event loop wake-up lag", [({}, perf_monitor.monitor)], 'lag')
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels, **extra):
+    pairs = {**labels, **extra}
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs.items()) + "}"
+
+
+def _counter(lines, name, help_text, series, attribute):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} counter")
+    for labels, stats in series:
+        lines.append(f"{name}{_labels(labels)} {getattr(stats, attribute)}")
+
+
+def _histogram(lines, name, help_text, series, attribute):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} histogram")
+    for labels, stats in series:
+        histogram = getattr(stats, attribute)
+        cumulative = 0
+        for bound, count in zip(histogram.bounds, histogram.counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_labels(labels, le=f'{bound:g}')} {cumulative}")
+        lines.append(f"{name}_bucket{_labels(labels, le='+Inf')} {histogram.count}")
+        lines.append(f"{name}_sum{_labels(labels)} {histogram.total}")
+        lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+
+
+def _can_time_responses():
+    """Whether the discord.py internals _TimedInteractionResponse hooks into still look the way it expects.
+
+    Checked against discord.py 2.3.2: Interaction.response is a cached slot
+    property stored in _cs_response, and InteractionResponse keeps the response
+    type in a _response_type slot that is set when the first response goes out.
+    """
+    response = discord.Interaction.__dict__.get('response')
+    return (
+        getattr(response, 'name', None) == '_cs_response'
+        and '_cs_response' in getattr(discord.Interaction, '__slots__', ())
+        and '_response_type' in getattr(discord.InteractionResponse, '__slots__', ())
+    )
+
+
+class _TimedInteractionResponse(discord.InteractionResponse):
+    """InteractionResponse that remembers when the first response (or defer) went out.
+
+    Relies on discord.py private attributes; see _can_time_responses().
+    """
+
+    __slots__ = ('_type', 'responded_at')
+
+    @property
+    def _response_type(self):
+        return getattr(self, '_type', None)
+
+    @_response_type.setter
+    def _response_type(self, value):
+        if value is not None and self._response_type is None:
+            self.responded_at = time.perf_counter()
+        self._type = value
+
+
+class MetricsCommandTree(app_commands.CommandTree):
+    """Command tree that starts the clock on every app command before its checks run"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.time_responses = _can_time_responses()
+        if not self.time_responses:
+            logger.warning(
+                f"discord.py {discord.__version__} changed the interaction internals that defer timing hooks into; "
+                "defer latency will not be recorded"
+            )
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        interaction.extras['metrics_started_at'] = time.perf_counter()
+        if self.time_responses:
+            # Interaction.response is a cached slot, so presetting it swaps in the timed subclass
+            interaction._cs_response = _TimedInteractionResponse(interaction)
+        return True
+
+
+class MetricsServer:
+    """Serves /metrics for Prometheus on a local port"""
+
+    def __init__(self, metrics, host="127.0.0.1", port=9100):
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self._runner = None
+
+    @classmethod
+    def from_env(cls, metrics):
+        port = int(os.getenv("METRICS_PORT", "0"))
+        if not port:
+            return None
+        return cls(metrics, host=os.getenv("METRICS_HOST", "127.0.0.1"), port=port)
+
+    async def _handle(self, request):
+        return web.Response(text=self.metrics.render_prometheus(), content_type="text/plain", charset="utf-8")
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+metrics = CommandMetrics(max_guild_series=int(os.getenv("METRICS_MAX_GUILD_SERIES", "2000")))
@@ -0,0 +1,376 @@
+import asyncio
+import os
+import re
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import parse_qs, urlparse
+
+import cachetools
+import yt_dlp
+
+YDL_OPTIONS = {
+    # Prefer Opus so playback can pass the stream through without re-encoding
+    'format': 'bestaudio[acodec=opus]/bestaudio/best',
+    'noplaylist': True,
+    'quiet': True,
+    'no_warnings': True,
+    'socket_timeout': 10,
+}
+
+# One request lists a whole playlist without resolving each video
+FLAT_PLAYLIST_OPTIONS = {
+    'extract_flat': 'in_playlist',
+    'quiet': True,
+    'no_warnings': True,
+    'socket_timeout': 10,
+}
+UNAVAILABLE_TITLES = {'[Private video]', '[Deleted video]'}
+
+# How often the lag probe wakes up while extractions are in flight
+LAG_PROBE_INTERVAL = 0.1
+# Re-resolve a stream this many seconds before googlevideo says it expires
+STREAM_EXPIRY_MARGIN = 60
+# Lifetime assumed for stream URLs that carry no expire= parameter
+DEFAULT_STREAM_TTL = 1800
+
+VIDEO_ID_PATTERN = re.compile(r'(?:[?&]v=|youtu\.be/|/shorts/|/embed/|/live/)([\w-]{11})')
+
+
+class ExtractionError(Exception):
+    pass
+
+
+def video_id_from_url(url):
+    match = VIDEO_ID_PATTERN.search(url)
+    return match.group(1) if match else None
+
+def stream_expiry(stream_url):
+    expire = parse_qs(urlparse(stream_url).query).get('expire')
+    if expire and expire[0].isdigit():
+        return float(expire[0])
+    return time.time() + DEFAULT_STREAM_TTL
+
+def summarize_info(info):
+    """Keep only the parts of a yt_dlp info dict that playback needs"""
+    return {
+        'id': info.get('id'),
+        'title': info.get('title'),
+        'stream_url': info['url'],
+        'expires_at': stream_expiry(info['url']),
+        'duration': info.get('duration'),
+        'thumbnail': info.get('thumbnail'),
+        'acodec': info.get('acodec'),
+        'abr': info.get('abr'),
+    }
+
+def stream_is_fresh(info):
+    return bool(info) and info['expires_at'] - STREAM_EXPIRY_MARGIN > time.time()
+
+
+class _CountingLRUCache(cachetools.LRUCache):
+    def __init__(self, maxsize, getsizeof=None):
+        super().__init__(maxsize, getsizeof=getsizeof)
+        self.evictions = 0
+
+    def popitem(self):
+        item = super().popitem()
+        self.evictions += 1
+        return item
+
+
+class ExtractionCache:
+    """LRU cache of extraction summaries keyed by video ID, capped by entry count and bytes.
+
+    Metadata stays until the entry is evicted; the stream URL is only handed out
+    while its expire= timestamp is still comfortably in the future.
+    """
+
+    def __init__(self, max_entries=2048, max_bytes=8 * 1024 * 1024):
+        self.max_entries = max_entries
+        self._entries = _CountingLRUCache(max_bytes, getsizeof=self._sizeof)
+        self.hits = 0
+        self.metadata_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _sizeof(entry):
+        return sys.getsizeof(entry) + sum(sys.getsizeof(value) for value in entry.values())
+
+    def get(self, video_id, need_stream=True):
+        entry = self._entries.get(video_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        if stream_is_fresh(entry):
+            self.hits += 1
+            return entry
+        if need_stream:
+            self.misses += 1
+            return None
+        self.metadata_hits += 1
+        return dict(entry, stream_url=None, expires_at=0)
+
+    def put(self, video_id, entry):
+        if video_id in self._entries:
+            del self._entries[video_id]
+        while len(self._entries) >= self.max_entries:
+            self._entries.popitem()
+        try:
+            self._entries[video_id] = entry
+        except ValueError:
+            # Larger than the whole byte budget; not worth caching
+            pass
+
+    def clear(self):
+        self._entries.clear()
+
+    @property
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'bytes': self._entries.currsize,
+            'max_bytes': self._entries.maxsize,
+            'hits': self.hits,
+            'metadata_hits': self.metadata_hits,
+            'misses': self.misses,
+            'evictions': self._entries.evictions,
+        }
+
+
+class _Priority:
+    """Mutable priority of one queued extraction; a background job is promoted once someone waits on it"""
+    __slots__ = ('urgent',)
+
+    def __init__(self, urgent):
+        self.urgent = urgent
+
+
+class _PrioritySemaphore:
+    """asyncio.Semaphore that hands free slots to urgent waiters before background ones"""
+
+    def __init__(self, value):
+        self._value = value
+        self._waiters = deque()
+
+    async def acquire(self, priority):
+        if self._value > 0 and not self._waiters:
+            self._value -= 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        entry = (waiter, priority)
+        self._waiters.append(entry)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.cancelled():
+                self._waiters.remove(entry)
+                self._wake()
+            else:
+                # Granted just as we were cancelled: pass the slot on
+                self.release()
+            raise
+
+    def release(self):
+        self._value += 1
+        self._wake()
+
+    def _wake(self):
+        while self._value > 0:
+            # Cancelled waiters stay queued until their task runs; skip them
+            waiting = [entry for entry in self._waiters if not entry[0].done()]
+            if not waiting:
+                return
+            entry = next((entry for entry in waiting if entry[1].urgent), waiting[0])
+            self._waiters.remove(entry)
+            self._value -= 1
+            entry[0].set_result(None)
+
+
+def _run_extraction(url, opts):
+    """Runs inside a worker; must stay a top-level function so process pools can pickle it"""
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        info = ydl.extract_info(url, download=False)
+        return ydl.sanitize_info(info)
+
+
+class ExtractionService:
+    """Runs yt_dlp extractions in a bounded worker pool so the event loop never blocks on them"""
+
+    def __init__(self, max_workers=4, per_guild=1, timeout=20.0, use_processes=False, cache=None):
+        self.max_workers = max_workers
+        self.per_guild = per_guild
+        self.timeout = timeout
+        self.use_processes = use_processes
+        self._executor = None
+        self._slots = None
+        self._guild_slots = {}
+        self._in_flight = 0
+        self._resolving = {}
+        self._lag_task = None
+        self.cache = cache if cache is not None else ExtractionCache()
+        self.stats = {
+            'extractions': 0,
+            'failures': 0,
+            'timeouts': 0,
+            'coalesced': 0,
+            'queue_wait_seconds': 0.0,
+            'worker_seconds': 0.0,
+            'loop_blocked_seconds': 0.0,
+            'max_loop_stall': 0.0,
+        }
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_workers=int(os.getenv("YTDL_WORKERS", "4")),
+            per_guild=int(os.getenv("YTDL_PER_GUILD", "1")),
+            timeout=float(os.getenv("YTDL_TIMEOUT", "20")),
+            use_processes=os.getenv("YTDL_EXECUTOR", "thread").lower() == "process",
+            cache=ExtractionCache(
+                max_entries=int(os.getenv("EXTRACTION_CACHE_ENTRIES", "2048")),
+                max_bytes=int(os.getenv("EXTRACTION_CACHE_BYTES", str(8 * 1024 * 1024))),
+            ),
+        )
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.use_processes:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="ytdl")
+            self._slots = _PrioritySemaphore(self.max_workers)
+        return self._executor
+
+    def _guild_slot(self, guild_id):
+        slot = self._guild_slots.get(guild_id)
+        if slot is None:
+            slot = self._guild_slots[guild_id] = _PrioritySemaphore(self.per_guild)
+        return slot
+
+    async def extract(self, url, guild_id=None, opts=None, urgent=True):
+        """Extract info for url without touching the event loop thread.
+
+        Background work (urgent=False) only gets a worker when no urgent job is waiting.
+        """
+        return await self._extract(url, guild_id, opts, _Priority(urgent))
+
+    async def _extract(self, url, guild_id, opts, priority):
+        executor = self._get_executor()
+        loop = asyncio.get_running_loop()
+        queued_at = time.perf_counter()
+
+        # A guild may only hold per_guild workers, so one busy server can't starve the rest
+        guild_slot = self._guild_slot(guild_id)
+        # Hold on to this pool's semaphore: shutdown() may swap in a new one while the job runs
+        slots = self._slots
+        await guild_slot.acquire(priority)
+        try:
+            await slots.acquire(priority)
+        except BaseException:
+            guild_slot.release()
+            raise
+        started_at = time.perf_counter()
+        self.stats['queue_wait_seconds'] += started_at - queued_at
+        self._track_in_flight(1)
+
+        # Slots are only handed back once the worker is really free, even after a timeout, so
+        # holding one means a worker is idle and the timeout below only counts running time
+        future = loop.run_in_executor(executor, _run_extraction, url, opts or YDL_OPTIONS)
+        future.add_done_callback(lambda done: self._finish_extraction(done, slots, guild_slot, started_at))
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            self.stats['timeouts'] += 1
+            raise ExtractionError(f"Timed out after {self.timeout:g}s while extracting {url}")
+        except Exception:
+            self.stats['failures'] += 1
+            raise
+
+    def _finish_extraction(self, future, slots, guild_slot, started_at):
+        if not future.cancelled():
+            # Retrieve it so a worker that fails after its caller timed out isn't reported as unhandled
+            future.exception()
+        self.stats['extractions'] += 1
+        self.stats['worker_seconds'] += time.perf_counter() - started_at
+        self._track_in_flight(-1)
+        slots.release()
+        guild_slot.release()
+
+    async def resolve(self, url, guild_id=None, need_stream=True, urgent=True):
+        """Return a playback summary for url, going through the cache first.
+
+        With need_stream=False a cached entry whose stream has expired is still
+        returned (stream_url is None), which is enough to queue a track.
+        Concurrent calls for the same video share one extraction, which keeps
+        running even if the caller that started it is cancelled.
+        """
+        # Other sites are keyed by URL, since their ids can't be known before extracting
+        key = video_id_from_url(url) or url
+        cached = self.cache.get(key, need_stream)
+        if cached is not None:
+            return cached
+
+        pending = self._resolving.get(key)
+        if pending is None:
+            priority = _Priority(urgent)
+            task = asyncio.create_task(self._resolve_uncached(url, key, guild_id, priority))
+            pending = self._resolving[key] = (task, priority)
+            task.add_done_callback(lambda done: self._resolved(key, pending))
+        else:
+            self.stats['coalesced'] += 1
+            if urgent:
+                # e.g. the player reaching a song whose prefetch is still queued
+                pending[1].urgent = True
+        return await asyncio.shield(pending[0])
+
+    async def _resolve_uncached(self, url, key, guild_id, priority):
+        summary = summarize_info(await self._extract(url, guild_id, None, priority))
+        self.cache.put(key, summary)
+        return summary
+
+    def _resolved(self, key, pending):
+        if self._resolving.get(key) is pending:
+            del self._resolving[key]
+        task = pending[0]
+        if not task.cancelled():
+            # Mark it retrieved so asyncio doesn't warn when every caller had given up
+            task.exception()
+
+    async def extract_playlist(self, url, guild_id=None, limit=200):
+        """Flat-extract a playlist; returns (title, entries, total) without resolving any video"""
+        info = await self.extract(url, guild_id, dict(FLAT_PLAYLIST_OPTIONS, playlistend=limit))
+        entries = [
+            entry for entry in (info.get('entries') or [])
+            if entry and entry.get('title') not in UNAVAILABLE_TITLES
+        ][:limit]
+        return info.get('title'), entries, info.get('playlist_count') or len(entries)
+
+    def _track_in_flight(self, delta):
+        self._in_flight += delta
+        if self._in_flight and (self._lag_task is None or self._lag_task.done()):
+            self._lag_task = asyncio.create_task(self._probe_loop_lag())
+
+    async def _probe_loop_lag(self):
+        # While extractions run, any oversleep here is time the loop spent blocked
+        while self._in_flight:
+            before = time.perf_counter()
+            await asyncio.sleep(LAG_PROBE_INTERVAL)
+            stall = time.perf_counter() - before - LAG_PROBE_INTERVAL
+            if stall > 0:
+                self.stats['loop_blocked_seconds'] += stall
+                self.stats['max_loop_stall'] = max(self.stats['max_loop_stall'], stall)
+
+    def shutdown(self):
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+            self._lag_task = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            self._slots = None
+        self._guild_slots.clear()
+
+
+extractor = ExtractionService.from_env()
@@ -0,0 +1,205 @@
+import random
+from collections import deque
+from itertools import islice
+
+from utils.extraction import video_id_from_url
+
+# Canonical int object per requester, so thousands of queued tracks share one
+_requester_ids = {}
+
+
+class Track:
+    """A queued song. YouTube tracks store only their video ID; other sites keep the full URL."""
+
+    __slots__ = ('video_id', 'title', 'requester_id', 'duration', 'info')
+
+    def __init__(self, video_id, title, requester_id, duration=None, info=None):
+        self.video_id = video_id
+        self.title = title
+        self.requester_id = _requester_ids.setdefault(requester_id, requester_id)
+        self.duration = duration
+        self.info = info
+
+    @classmethod
+    def from_url(cls, url, title, requester_id, info=None):
+        return cls(
+            video_id_from_url(url) or url,
+            title,
+            requester_id,
+            duration=info.get('duration') if info else None,
+            # Metadata-only summaries carry no stream, so there's nothing worth keeping a reference to
+            info=info if info and info.get('stream_url') else None,
+        )
+
+    @classmethod
+    def from_flat_entry(cls, entry, requester_id):
+        """Build a still-unresolved track from a flat playlist entry"""
+        video_id = entry['id'] if entry.get('ie_key') == 'Youtube' else entry['url']
+        return cls(video_id, entry.get('title') or video_id, requester_id, duration=entry.get('duration'))
+
+    @property
+    def url(self):
+        if '://' in self.video_id:
+            return self.video_id
+        return f"https://www.youtube.com/watch?v={self.video_id}"
+
+    def to_row(self):
+        # Stream info expires within hours, so only the stable fields are persisted
+        return [self.video_id, self.title, self.requester_id, self.duration]
+
+    @classmethod
+    def from_row(cls, row):
+        video_id, title, requester_id, duration = row
+        return cls(video_id, title, requester_id, duration=duration)
+
+    @property
+    def requester(self):
+        return f"<@{self.requester_id}>"
+
+    def __repr__(self):
+        return f"Track({self.video_id!r}, {self.title!r})"
+
+
+class GuildQueue:
+    """A guild's song queue with O(1) pop-front/append.
+
+    While looping, every song that starts playing is also appended to a replay
+    deque. When the upcoming songs run out the two deques are swapped, so loop
+    mode never copies the queue.
+
+    If journal is set, every mutation is reported to it as (op, *args) so the
+    queue can be rebuilt later by replaying them through apply(). version goes
+    up on every mutation, which lets views cache what they render.
+    """
+
+    __slots__ = ('_upcoming', '_replay', 'current', 'looping', 'journal', 'version')
+
+    def __init__(self):
+        self._upcoming = deque()
+        self._replay = deque()
+        self.current = None
+        self.looping = False
+        self.journal = None
+        self.version = 0
+
+    def __len__(self):
+        return len(self._upcoming)
+
+    def __iter__(self):
+        return iter(self._upcoming)
+
+    def _record(self, op, *args):
+        self.version += 1
+        if self.journal is not None:
+            self.journal(op, *args)
+
+    def peek(self, count):
+        return list(islice(self._upcoming, count))
+
+    def page(self, start, count):
+        return list(islice(self._upcoming, start, start + count))
+
+    def append(self, track):
+        self._upcoming.append(track)
+        self._record('append', track.to_row())
+
+    def pop_next(self):
+        """Advance to the next song, making it current; returns None when nothing is left"""
+        self._record('pop')
+        if not self._upcoming and self.looping and self._replay:
+            self._upcoming, self._replay = self._replay, deque()
+        if not self._upcoming:
+            self.current = None
+            return None
+        self.current = self._upcoming.popleft()
+        if self.looping:
+            self._replay.append(self.current)
+        return self.current
+
+    def drop_current(self):
+        self.current = None
+        self._record('drop')
+
+    def requeue_current(self):
+        """Put the current song back at the front, e.g. after a restart interrupted it"""
+        if self.current is None:
+            return
+        if self.looping and self._replay and self._replay[-1] is self.current:
+            self._replay.pop()
+        self._upcoming.appendleft(self.current)
+        self.current = None
+        self._record('requeue')
+
+    def remove(self, index):
+        if not 0 <= index < len(self._upcoming):
+            return None
+        track = self._upcoming[index]
+        del self._upcoming[index]
+        self._record('remove', index)
+        return track
+
+    def shuffle(self, seed=None):
+        # The seed is journaled instead of the new order, so replaying a shuffle stays O(1) to record
+        if seed is None:
+            seed = random.getrandbits(32)
+        # random.shuffle on a deque is quadratic because of its indexed access
+        tracks = list(self._upcoming)
+        random.Random(seed).shuffle(tracks)
+        self._upcoming = deque(tracks)
+        self._record('shuffle', seed)
+
+    def clear(self):
+        self._upcoming.clear()
+        self._replay.clear()
+        self.current = None
+        self._record('clear')
+
+    def set_looping(self, looping):
+        self.looping = looping
+        self._replay = deque()
+        # The song that is playing when loop is enabled starts the next cycle
+        if looping and self.current is not None:
+            self._replay.append(self.current)
+        self._record('loop', looping)
+
+    def apply(self, op, *args):
+        """Replay one journaled mutation"""
+        if op == 'append':
+            self.append(Track.from_row(args[0]))
+        elif op == 'pop':
+            self.pop_next()
+        elif op == 'drop':
+            self.drop_current()
+        elif op == 'requeue':
+            self.requeue_current()
+        elif op == 'remove':
+            self.remove(args[0])
+        elif op == 'shuffle':
+            self.shuffle(args[0])
+        elif op == 'clear':
+            self.clear()
+        elif op == 'loop':
+            self.set_looping(args[0])
+
+    def to_state(self):
+        return {
+            'upcoming': [track.to_row() for track in self._upcoming],
+            'replay': [track.to_row() for track in self._replay],
+            'current': self.current.to_row() if self.current else None,
+            'looping': self.looping,
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        queue = cls()
+        queue._upcoming.extend(Track.from_row(row) for row in state['upcoming'])
+        queue._replay.extend(Track.from_row(row) for row in state['replay'])
+        queue.looping = state['looping']
+        if state['current'] is None:
+            queue.current = None
+        elif queue.looping and state['replay'] and state['replay'][-1] == state['current']:
+            # While looping the current song is also the tail of the replay deque
+            queue.current = queue._replay[-1]
+        else:
+            queue.current = Track.from_row(state['current'])
+        return queue
@@ -0,0 +1,175 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+from functools import partial
+
+from utils.music_queue import GuildQueue
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    guild_id INTEGER PRIMARY KEY,
+    seq INTEGER NOT NULL,
+    state TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS journal (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    guild_id INTEGER NOT NULL,
+    op TEXT NOT NULL,
+    args TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS journal_guild ON journal (guild_id, seq);
+"""
+
+
+class QueueStore:
+    """Crash-safe queue persistence: an append-only SQLite (WAL) journal of queue mutations.
+
+    Mutations are buffered in memory and written in one transaction every
+    flush_interval seconds, so busy /play traffic doesn't commit per command.
+    Once a guild has compact_after journal rows, its current state is written
+    as a snapshot and the rows it covers are dropped. preload() reads every
+    saved queue in a worker thread at startup, so load() can rebuild one
+    without touching SQLite on the event loop.
+    """
+
+    def __init__(self, path, flush_interval=2.0, compact_after=500):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.compact_after = compact_after
+        self._conn = None
+        self._db_lock = threading.Lock()
+        self._pending = []
+        self._flush_task = None
+        self._queues = {}
+        self._journal_counts = {}
+        # guild_id -> (snapshot state, journal rows after it), until the guild is loaded
+        self._saved = None
+
+    @classmethod
+    def from_env(cls):
+        path = os.getenv("MUSIC_STATE_DB", "music_state.db")
+        if not path:
+            return None
+        return cls(
+            path,
+            flush_interval=float(os.getenv("MUSIC_STATE_FLUSH_INTERVAL", "2")),
+            compact_after=int(os.getenv("MUSIC_STATE_COMPACT_AFTER", "500")),
+        )
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            # With WAL, NORMAL survives process crashes without an fsync per commit
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    async def preload(self):
+        self._saved = await asyncio.to_thread(self._read_all)
+
+    def _read_all(self):
+        with self._db_lock:
+            conn = self._connection()
+            saved = {
+                guild_id: (state, [])
+                for guild_id, state in conn.execute("SELECT guild_id, state FROM snapshots")
+            }
+            rows = conn.execute(
+                "SELECT journal.guild_id, op, args FROM journal LEFT JOIN snapshots USING (guild_id)"
+                " WHERE journal.seq > COALESCE(snapshots.seq, 0) ORDER BY journal.seq"
+            )
+            for guild_id, op, args in rows:
+                saved.setdefault(guild_id, (None, []))[1].append((op, args))
+        return saved
+
+    def _read(self, guild_id):
+        with self._db_lock:
+            conn = self._connection()
+            snapshot = conn.execute("SELECT seq, state FROM snapshots WHERE guild_id = ?", (guild_id,)).fetchone()
+            seq, state = snapshot if snapshot else (0, None)
+            rows = conn.execute(
+                "SELECT op, args FROM journal WHERE guild_id = ? AND seq > ? ORDER BY seq",
+                (guild_id, seq)
+            ).fetchall()
+        return state, rows
+
+    def load(self, guild_id):
+        """Rebuild a guild's queue from its snapshot plus later journal rows and start journaling it"""
+        if self._saved is not None:
+            state, rows = self._saved.pop(guild_id, (None, []))
+        else:
+            # Not preloaded (e.g. used outside the cog): read it here, blocking
+            state, rows = self._read(guild_id)
+
+        queue = GuildQueue.from_state(json.loads(state)) if state else GuildQueue()
+        for op, args in rows:
+            queue.apply(op, *json.loads(args))
+        self._journal_counts[guild_id] = len(rows)
+        self.attach(guild_id, queue)
+
+        # Whatever was playing when the bot went down gets another go
+        queue.requeue_current()
+        return queue
+
+    def attach(self, guild_id, queue):
+        self._queues[guild_id] = queue
+        queue.journal = partial(self.record, guild_id)
+
+    def record(self, guild_id, op, *args):
+        self._pending.append((guild_id, op, json.dumps(args)))
+        self._journal_counts[guild_id] = self._journal_counts.get(guild_id, 0) + 1
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        # Changes recorded while a write was running saw this task still busy, so go round again
+        while self._pending:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+
+        # Snapshots are taken now, in step with the batch, so they cover exactly the rows being written
+        snapshots = {}
+        for guild_id, count in self._journal_counts.items():
+            if count >= self.compact_after and guild_id in self._queues:
+                snapshots[guild_id] = json.dumps(self._queues[guild_id].to_state())
+        for guild_id in snapshots:
+            self._journal_counts[guild_id] = 0
+
+        try:
+            await asyncio.to_thread(self._write, batch, snapshots)
+        except Exception as e:
+            logger.error(f"Failed to persist {len(batch)} queue change(s): {e}")
+
+    def _write(self, batch, snapshots):
+        with self._db_lock:
+            conn = self._connection()
+            with conn:
+                conn.executemany("INSERT INTO journal (guild_id, op, args) VALUES (?, ?, ?)", batch)
+                for guild_id, state in snapshots.items():
+                    seq = conn.execute("SELECT MAX(seq) FROM journal WHERE guild_id = ?", (guild_id,)).fetchone()[0] or 0
+                    conn.execute("INSERT OR REPLACE INTO snapshots (guild_id, seq, state) VALUES (?, ?, ?)", (guild_id, seq, state))
+                    conn.execute("DELETE FROM journal WHERE guild_id = ? AND seq <= ?", (guild_id, seq))
+
+    async def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+        with self._db_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+store = QueueStore.from_env()
@@ -1,23 +1,72 @@
 import asyncio
-import random
+import logging
+import os
+import time
 import discord
-import yt_dlp
+from utils.audio_cache import AudioDiskCache
+from utils.extraction import extractor, stream_is_fresh
+from utils.music_queue import GuildQueue
+from utils.music_store import store
+from utils.timer_wheel import TimerWheel
+from utils.youtube_search import YouTubeSearchError, search_cache
+
+logger = logging.getLogger(__name__)
+
+# How many upcoming songs to resolve while the current one plays
+PREFETCH_COUNT = int(os.getenv("MUSIC_PREFETCH_COUNT", "2"))
+# Also run ffprobe on prefetched streams so playback can skip it
+PREFETCH_PROBE = os.getenv("MUSIC_PREFETCH_PROBE", "false").lower() == "true"
+FFMPEG_BEFORE_OPTIONS = '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5'
+# Wait this long after the first failed song, doubling per consecutive failure up to the max
+FAILURE_BACKOFF = float(os.getenv("MUSIC_FAILURE_BACKOFF", "1"))
+FAILURE_BACKOFF_MAX = float(os.getenv("MUSIC_FAILURE_BACKOFF_MAX", "30"))
+# Stay connected this long after the queue empties, so the next /play skips the voice handshake
+IDLE_DISCONNECT = float(os.getenv("MUSIC_IDLE_DISCONNECT", "120"))
 
 last_searches = {}
-playlists = {}
-loop_status = {}
-currently_playing = {}
-original_playlists = {}
-
-
-def search_youtube(youtube, search_query, user_id):
-    request = youtube.search().list(
-        part="snippet",
-        q=search_query,
-        maxResults=5,
-        type="video"
-    )
-    response = request.execute()
+players = {}
+prefetch_tasks = {}
+# One wheel runs the idle-disconnect timers of every guild
+idle_timers = TimerWheel()
+# Optional on-disk Opus cache; None unless MUSIC_DISK_CACHE_DIR is set
+audio_cache = AudioDiskCache.from_env(FFMPEG_BEFORE_OPTIONS)
+playback_stats = {
+    mode: {'streams': 0, 'startup_seconds': 0.0, 'cpu_streams': 0, 'cpu_seconds': 0.0}
+    for mode in ('disk_cache', 'passthrough', 'prefetched_probe', 'probed')
+}
+
+
+def _process_cpu_seconds(pid):
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+    except OSError:
+        return None
+    # utime and stime are fields 14 and 15 of /proc/<pid>/stat
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+class MeasuredOpusAudio(discord.FFmpegOpusAudio):
+    """FFmpegOpusAudio that records how much CPU its ffmpeg process used"""
+    mode = 'probed'
+
+    def cleanup(self):
+        process = getattr(self, '_process', None)
+        if process:
+            cpu = _process_cpu_seconds(process.pid)
+            if cpu is not None:
+                stats = playback_stats[self.mode]
+                stats['cpu_streams'] += 1
+                stats['cpu_seconds'] += cpu
+        super().cleanup()
+
+
+async def search_youtube(youtube, search_query, user_id):
+    try:
+        response = await search_cache.get_or_fetch(search_query, youtube.search)
+    except YouTubeSearchError as e:
+        logger.warning(f"YouTube search failed for {search_query!r}: {e}")
+        return None
     
     if "items" in response:
         video_urls = [f"https://www.youtube.com/watch?v={item['id']['videoId']}" for item in response['items']]
@@ -28,122 +77,241 @@ def search_youtube(youtube, search_query, user_id):
 def get_last_search(user_id):
     return last_searches.get(user_id, [])
 
-def add_to_playlist(server_id, song_url, song_title, added_by):
-    if server_id not in playlists:
-        playlists[server_id] = []
-    playlists[server_id].append((song_url, song_title, added_by))
+class GuildPlayer:
+    """Everything the music commands need for one guild, reachable with a single dict lookup.
+
+    Playback is driven by one long-lived task per active guild: it plays songs
+    until the queue runs dry, waiting on an Event set by the FFmpeg after
+    callback instead of chaining a new coroutine per song.
+    """
+
+    __slots__ = ('guild_id', 'queue', 'voice_client', 'text_channel', 'failures', '_task', '_song_done', '_song_error')
+
+    def __init__(self, guild_id, queue):
+        self.guild_id = guild_id
+        self.queue = queue
+        self.voice_client = None
+        self.text_channel = None
+        self.failures = 0
+        self._task = None
+        self._song_done = asyncio.Event()
+        self._song_error = None
+
+    def is_active(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        """Start the player task unless it is already running"""
+        idle_timers.cancel(self.guild_id)
+        if not self.is_active():
+            self._task = asyncio.create_task(self._run())
+        return self._task
+
+    def schedule_idle_disconnect(self):
+        if IDLE_DISCONNECT > 0:
+            idle_timers.schedule(self.guild_id, IDLE_DISCONNECT, self._idle_disconnect)
+
+    async def _idle_disconnect(self):
+        if self.is_active() or not self.is_connected():
+            return
+        await self.disconnect()
+        if self.text_channel is not None:
+            await self._send("Disconnected from voice channel due to inactivity.")
+
+    async def _run(self):
+        while True:
+            # In loop mode the queue restarts the cycle by itself
+            track = self.queue.pop_next()
+            if track is None:
+                cancel_prefetch(self.guild_id)
+                if not self.is_connected():
+                    # /stop or /leave already disconnected on purpose; nothing to wait for or announce
+                    return
+                if IDLE_DISCONNECT > 0:
+                    # Keep the connection around in case more songs are added soon
+                    self.schedule_idle_disconnect()
+                    await self._send(f"Playlist is empty. Leaving the voice channel in {IDLE_DISCONNECT:g}s unless more songs are added.")
+                else:
+                    await self.disconnect()
+                    await self._send("Playlist is empty. Disconnected from voice channel.")
+                # A /play during the awaits above saw this task as active and left the new song to it
+                if not self.queue:
+                    return
+                idle_timers.cancel(self.guild_id)
+                continue
+            
+            if not self.is_connected():
+                await self._send("Not connected to a voice channel.")
+                self.queue.drop_current()
+                cancel_prefetch(self.guild_id)
+                return
+            
+            try:
+                await self._play(track)
+            except Exception as e:
+                self.failures += 1
+                await self._send(f"An error occurred while trying to play the next song: {str(e)}")
+                # Back off so a queue full of broken links can't spin through the loop
+                await asyncio.sleep(min(FAILURE_BACKOFF * 2 ** (self.failures - 1), FAILURE_BACKOFF_MAX))
+                continue
+            
+            # The song is playing now; nothing below counts as a failure to play it
+            self.failures = 0
+            await self._send(
+                f"Now playing: {track.title} (added by {track.requester})",
+                allowed_mentions=discord.AllowedMentions.none()
+            )
+            await self._song_done.wait()
+            if self._song_error:
+                await self._send(f"An error occurred: {str(self._song_error)}")
+
+    async def _send(self, content, **kwargs):
+        """Post to the guild's text channel; a failed send (e.g. missing permissions) must not stop playback"""
+        try:
+            await self.text_channel.send(content, **kwargs)
+        except Exception as e:
+            logger.warning(f"Could not send a message for guild {self.guild_id}: {e}")
+
+    async def _play(self, track):
+        """Start playing track; returns once the audio is running"""
+        started_at = time.perf_counter()
+        cached_path = audio_cache.lookup(track.video_id) if audio_cache and '://' not in track.video_id else None
+        if cached_path:
+            # Hot track: play the local copy without touching YouTube at all
+            source = MeasuredOpusAudio(cached_path, codec='opus')
+            source.mode = 'disk_cache'
+        else:
+            # Reuse the stream resolved by /play unless it is about to expire
+            if not stream_is_fresh(track.info):
+                track.info = await extractor.resolve(track.url, self.guild_id)
+            source = await create_source(track.info)
+            # Only Opus streams can be stored without re-encoding
+            if audio_cache and track.info.get('acodec') == 'opus' and '://' not in track.video_id:
+                audio_cache.note_play(track.video_id, track.info['stream_url'], track.duration)
+        
+        loop = asyncio.get_running_loop()
+        
+        def after_playing(error):
+            self._song_error = error
+            loop.call_soon_threadsafe(self._song_done.set)
+        
+        self._song_done.clear()
+        self._song_error = None
+        self.voice_client.play(source, after=after_playing)
+        stats = playback_stats[source.mode]
+        stats['streams'] += 1
+        stats['startup_seconds'] += time.perf_counter() - started_at
+        schedule_prefetch(self.guild_id)
+
+    def is_connected(self):
+        return self.voice_client is not None and self.voice_client.is_connected()
+
+    def is_playing(self):
+        return self.is_connected() and self.voice_client.is_playing()
+
+    async def connect(self, channel):
+        if not self.is_connected():
+            # Pick up a connection made before this player existed (e.g. across a cog reload)
+            self.voice_client = channel.guild.voice_client or await channel.connect()
+            if not self.is_active():
+                self.schedule_idle_disconnect()
+        return self.voice_client
+
+    async def disconnect(self):
+        idle_timers.cancel(self.guild_id)
+        voice_client, self.voice_client = self.voice_client, None
+        if voice_client is not None and voice_client.is_connected():
+            await voice_client.disconnect()
+
+def get_player(guild_id):
+    player = players.get(guild_id)
+    if player is None:
+        # Restored lazily, the first time anything touches this guild's queue
+        queue = store.load(guild_id) if store else GuildQueue()
+        player = players[guild_id] = GuildPlayer(guild_id, queue)
+    return player
+
+def get_queue(guild_id):
+    return get_player(guild_id).queue
+
+def add_to_playlist(server_id, track):
+    queue = get_queue(server_id)
+    queue.append(track)
+    # A song landing inside the prefetch window while another plays would otherwise wait for its turn
+    if queue.current is not None and len(queue) <= PREFETCH_COUNT:
+        schedule_prefetch(server_id)
 
 def remove_from_playlist(server_id, index):
-    if server_id in playlists and 0 <= index < len(playlists[server_id]):
-        return playlists[server_id].pop(index)
-    return None
+    removed = get_queue(server_id).remove(index)
+    if removed and index < PREFETCH_COUNT:
+        reschedule_prefetch(server_id)
+    return removed
 
 def get_playlist(server_id):
-    return playlists.get(server_id, [])
+    return get_queue(server_id)
 
 def shuffle_playlist(server_id):
-    if server_id in playlists:
-        random.shuffle(playlists[server_id])
+    get_queue(server_id).shuffle()
+    reschedule_prefetch(server_id)
 
 def clear_playlist(server_id):
-    if server_id in playlists:
-        playlists[server_id].clear()
-    if server_id in original_playlists:
-        original_playlists[server_id].clear()
-    if server_id in currently_playing:
-        del currently_playing[server_id]
+    cancel_prefetch(server_id)
+    get_queue(server_id).clear()
         
 def toggle_loop(guild_id):
-    loop_status[guild_id] = not loop_status.get(guild_id, False)
-    if loop_status[guild_id]:
-        # When enabling loop, save current playlist state
-        current_playlist = playlists.get(guild_id, []).copy()
-        # If there's a currently playing song, include it at the beginning
-        if guild_id in currently_playing:
-            current_playlist.insert(0, currently_playing[guild_id])
-        original_playlists[guild_id] = current_playlist
-    elif not loop_status[guild_id] and guild_id in original_playlists:
-        del original_playlists[guild_id]
-    return loop_status[guild_id]
+    queue = get_queue(guild_id)
+    queue.set_looping(not queue.looping)
+    return queue.looping
 
 def is_looping(guild_id):
-    return loop_status.get(guild_id, False)
+    return get_queue(guild_id).looping
 
 def get_currently_playing(guild_id):
-    return currently_playing.get(guild_id, None)
+    return get_queue(guild_id).current
 
-async def play_next(client, guild_id, text_channel):
-    playlist = get_playlist(guild_id)
-    
-    # Check if playlist is empty
-    if not playlist:
-        # If looping is enabled and we have an original playlist, restore it
-        if is_looping(guild_id) and guild_id in original_playlists and original_playlists[guild_id]:
-            playlists[guild_id] = original_playlists[guild_id].copy()
-            playlist = get_playlist(guild_id)
-        else:
-            # No songs to play, disconnect
-            voice_client = None
-            for vc in client.voice_clients:
-                if vc.guild.id == guild_id:
-                    voice_client = vc
-                    break
-            
-            if voice_client:
-                await voice_client.disconnect()
-            
-            # Clean up state
-            if guild_id in currently_playing:
-                del currently_playing[guild_id]
-            
-            await text_channel.send("Playlist is empty. Disconnected from voice channel.")
-            return
-    
-    # Get the next song from the playlist
-    next_song = playlist.pop(0)
-    url, title, added_by = next_song
-    
-    # Store currently playing song
-    currently_playing[guild_id] = next_song
-    
-    ydl_opts = {
-        'format': 'bestaudio/best',
-        'postprocessors': [{
-            'key': 'FFmpegExtractAudio',
-            'preferredcodec': 'mp3',
-            'preferredquality': '192',
-        }],
-    }
+def cancel_prefetch(guild_id):
+    task = prefetch_tasks.pop(guild_id, None)
+    if task:
+        task.cancel()
 
-    try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            url2 = info['url']
-            source = await discord.FFmpegOpusAudio.from_probe(url2, **{'before_options': '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5'})
-        
-        voice_client = None
-        for vc in client.voice_clients:
-            if vc.guild.id == guild_id:
-                voice_client = vc
-                break
-        
-        if voice_client:
-            def after_playing(error):
-                if error:
-                    asyncio.run_coroutine_threadsafe(
-                        text_channel.send(f"An error occurred: {str(error)}"), 
-                        client.loop
-                    )
-                asyncio.run_coroutine_threadsafe(play_next(client, guild_id, text_channel), client.loop)
-
-            voice_client.play(source, after=after_playing)
-            await text_channel.send(f"Now playing: {title} (added by {added_by})")
-        else:
-            await text_channel.send("Not connected to a voice channel.")
-            # Clean up state
-            if guild_id in currently_playing:
-                del currently_playing[guild_id]
-    except Exception as e:
-        await text_channel.send(f"An error occurred while trying to play the next song: {str(e)}")
-        # Try to play the next song in case of error
-        asyncio.create_task(play_next(client, guild_id, text_channel))
\ No newline at end of file
+def schedule_prefetch(guild_id):
+    """Resolve the next PREFETCH_COUNT songs in the background so the next transition is instant"""
+    cancel_prefetch(guild_id)
+    upcoming = get_queue(guild_id).peek(PREFETCH_COUNT)
+    if upcoming:
+        prefetch_tasks[guild_id] = asyncio.create_task(_prefetch(guild_id, upcoming))
+
+def reschedule_prefetch(guild_id):
+    # The queue order changed, so whatever is being prefetched may no longer be next
+    if get_currently_playing(guild_id) is not None:
+        schedule_prefetch(guild_id)
+    else:
+        cancel_prefetch(guild_id)
+
+async def _prefetch(guild_id, tracks):
+    for track in tracks:
+        try:
+            if not stream_is_fresh(track.info):
+                # Yields the worker to songs that are needed right now; the player joins this if it gets there first
+                track.info = await extractor.resolve(track.url, guild_id, urgent=False)
+            info = track.info
+            if PREFETCH_PROBE and info.get('acodec') != 'opus' and 'probe' not in info:
+                info['probe'] = await discord.FFmpegOpusAudio.probe(info['stream_url'])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.debug(f"Prefetch failed for {track.url}: {e}")
+
+async def create_source(info):
+    """Build the audio source, skipping ffprobe whenever the codec is already known"""
+    if info.get('acodec') == 'opus':
+        # yt_dlp already told us it's Opus, so ffmpeg can copy packets straight through
+        source = MeasuredOpusAudio(info['stream_url'], codec='opus', bitrate=int(info.get('abr') or 128), before_options=FFMPEG_BEFORE_OPTIONS)
+        source.mode = 'passthrough'
+    elif 'probe' in info:
+        codec, bitrate = info['probe']
+        source = MeasuredOpusAudio(info['stream_url'], codec=codec, bitrate=bitrate, before_options=FFMPEG_BEFORE_OPTIONS)
+        source.mode = 'prefetched_probe'
+    else:
+        source = await MeasuredOpusAudio.from_probe(info['stream_url'], before_options=FFMPEG_BEFORE_OPTIONS)
+    return source
@@ -0,0 +1,168 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from bisect import bisect_left
+from collections import Counter, deque
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds; anything slower lands in the overflow bucket
+DEFAULT_BOUNDS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0)
+STACK_DEPTH = 8
+
+
+def format_seconds(seconds):
+    return f"{seconds * 1000:.0f}ms" if seconds < 1 else f"{seconds:.1f}s"
+
+
+class Histogram:
+    """Fixed-bucket latency histogram: constant memory no matter how many values are recorded"""
+
+    __slots__ = ('bounds', 'counts', 'count', 'total', 'max')
+
+    def __init__(self, bounds=DEFAULT_BOUNDS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.counts[bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q):
+        """Upper bound of the bucket holding the q-th percentile (0-100)"""
+        if not self.count:
+            return 0.0
+        rank = self.count * q / 100
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def summary(self):
+        return (f"n={self.count} mean={format_seconds(self.mean)} p50≤{format_seconds(self.percentile(50))} "
+                f"p95≤{format_seconds(self.percentile(95))} p99≤{format_seconds(self.percentile(99))} "
+                f"max={format_seconds(self.max)}")
+
+    def render(self, width=20):
+        """Text bar chart, one line per non-empty bucket"""
+        peak = max(self.counts) or 1
+        lines = []
+        labels = [f"≤{format_seconds(bound)}" for bound in self.bounds] + [f">{format_seconds(self.bounds[-1])}"]
+        for label, count in zip(labels, self.counts):
+            if count:
+                lines.append(f"{label:>7} {'█' * max(1, round(count / peak * width)):<{width}} {count}")
+        return "\n".join(lines) or "no samples"
+
+
+class PerfMonitor:
+    """Measures event loop lag and captures what the loop thread was doing while it was stalled.
+
+    A task wakes every `interval` seconds and records how late it woke up. A
+    watchdog thread checks in between; whenever the loop is more than
+    `slow_threshold` seconds behind, it samples the loop thread's stack via
+    sys._current_frames(). When the task finally wakes, the most common
+    sampled stack is kept as a slow callback record.
+    """
+
+    def __init__(self, interval=0.25, slow_threshold=0.1, sample_interval=0.02, max_records=50):
+        self.interval = interval
+        self.slow_threshold = slow_threshold
+        self.sample_interval = sample_interval
+        self.lag = Histogram()
+        self.slow_callbacks = deque(maxlen=max_records)
+        self._lock = threading.Lock()
+        self._samples = Counter()
+        self._due = None
+        self._loop_thread = None
+        self._task = None
+        self._watchdog = None
+        self._stop = threading.Event()
+        self.started_at = None
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            interval=float(os.getenv("PERF_LAG_INTERVAL", "0.25")),
+            slow_threshold=float(os.getenv("PERF_SLOW_THRESHOLD", "0.1")),
+        )
+
+    def start(self):
+        """Start monitoring the running loop; safe to call more than once"""
+        if self._task is not None and not self._task.done():
+            return
+        self._loop_thread = threading.get_ident()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._measure())
+        self._watchdog = threading.Thread(target=self._watch, name="perf-watchdog", daemon=True)
+        self._watchdog.start()
+        self.started_at = time.time()
+
+    def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def reset(self):
+        with self._lock:
+            self.lag = Histogram()
+            self.slow_callbacks.clear()
+            self._samples.clear()
+
+    async def _measure(self):
+        while True:
+            self._due = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - self._due)
+            with self._lock:
+                self.lag.record(lag)
+                samples, self._samples = self._samples, Counter()
+            if lag >= self.slow_threshold:
+                self._record_slow(lag, samples)
+
+    def _record_slow(self, lag, samples):
+        if samples:
+            stack, hits = samples.most_common(1)[0]
+        else:
+            # Stalled between two watchdog checks
+            stack, hits = "(no stack sampled)", 0
+        self.slow_callbacks.append({
+            'at': time.time(),
+            'duration': lag,
+            'stack': stack,
+            'samples': sum(samples.values()),
+            'stack_hits': hits,
+        })
+        logger.warning(f"Event loop blocked for {format_seconds(lag)}; most sampled stack:\n{stack}")
+
+    def _watch(self):
+        while not self._stop.wait(self.sample_interval):
+            due = self._due
+            if due is None or time.monotonic() - due < self.slow_threshold:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            stack = "".join(traceback.format_list(traceback.extract_stack(frame)[-STACK_DEPTH:]))
+            del frame
+            with self._lock:
+                self._samples[stack] += 1
+
+
+monitor = PerfMonitor.from_env()
@@ -0,0 +1,75 @@
+import asyncio
+import inspect
+import logging
+import math
+from functools import partial
+
+logger = logging.getLogger(__name__)
+
+
+class TimerWheel:
+    """Hashed timer wheel: a single task ticks every `resolution` seconds and fires due callbacks.
+
+    Scheduling and cancelling are O(1), and the number of pending timers doesn't
+    change the number of tasks. The tick task only runs while timers are pending.
+    """
+
+    def __init__(self, resolution=1.0, slots=64):
+        self.resolution = resolution
+        self._slots = [{} for _ in range(slots)]
+        self._slot_of = {}
+        self._cursor = 0
+        self._task = None
+        # Running async callbacks; the loop only keeps weak references to tasks
+        self._running = set()
+
+    def __len__(self):
+        return len(self._slot_of)
+
+    def __contains__(self, key):
+        return key in self._slot_of
+
+    def schedule(self, key, delay, callback):
+        """Call callback() (sync or async) after roughly delay seconds, replacing any timer under key"""
+        self.cancel(key)
+        ticks = max(1, math.ceil(delay / self.resolution))
+        slot = (self._cursor + ticks) % len(self._slots)
+        # Full turns of the wheel to wait before the slot's timer is really due
+        rounds = (ticks - 1) // len(self._slots)
+        self._slots[slot][key] = [rounds, callback]
+        self._slot_of[key] = slot
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._tick())
+
+    def cancel(self, key):
+        slot = self._slot_of.pop(key, None)
+        if slot is not None:
+            del self._slots[slot][key]
+
+    async def _tick(self):
+        while self._slot_of:
+            await asyncio.sleep(self.resolution)
+            self._cursor = (self._cursor + 1) % len(self._slots)
+            slot = self._slots[self._cursor]
+            for key, timer in list(slot.items()):
+                if timer[0] > 0:
+                    timer[0] -= 1
+                    continue
+                del slot[key]
+                del self._slot_of[key]
+                self._fire(key, timer[1])
+
+    def _fire(self, key, callback):
+        try:
+            result = callback()
+            if inspect.isawaitable(result):
+                task = asyncio.ensure_future(result)
+                self._running.add(task)
+                task.add_done_callback(partial(self._finished, key))
+        except Exception as e:
+            logger.error(f"Timer {key!r} failed: {e}")
+
+    def _finished(self, key, task):
+        self._running.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Timer {key!r} failed: {task.exception()}")
@@ -0,0 +1,158 @@
+import asyncio
+import os
+from collections import deque
+from datetime import datetime, timezone
+
+import aiohttp
+import cachetools
+
+YOUTUBE_SEARCH_URL = "https://www.googleapis.com/youtube/v3/search"
+# Quota units the Data API charges for one search.list call
+SEARCH_QUOTA_COST = 100
+
+
+class YouTubeSearchError(Exception):
+    pass
+
+
+class YouTubeSearchClient:
+    """Non-blocking YouTube Data API search over a persistent aiohttp connection pool.
+
+    search() returns the same JSON shape as googleapiclient's search().list().execute().
+    """
+
+    def __init__(self, api_key, max_connections=10, max_concurrency=4, timeout=10.0):
+        self.api_key = api_key
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._session = None
+
+    @classmethod
+    def from_env(cls, api_key):
+        return cls(
+            api_key,
+            max_connections=int(os.getenv("YOUTUBE_SEARCH_CONNECTIONS", "10")),
+            max_concurrency=int(os.getenv("YOUTUBE_SEARCH_CONCURRENCY", "4")),
+            timeout=float(os.getenv("YOUTUBE_SEARCH_TIMEOUT", "10")),
+        )
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections, ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._session
+
+    async def search(self, query, max_results=5):
+        params = {
+            'part': 'snippet',
+            'q': query,
+            'maxResults': max_results,
+            'type': 'video',
+            'key': self.api_key,
+        }
+        async with self._semaphore:
+            try:
+                async with self._get_session().get(YOUTUBE_SEARCH_URL, params=params) as response:
+                    if response.status != 200:
+                        raise YouTubeSearchError(f"YouTube API returned HTTP {response.status}: {await response.text()}")
+                    return await response.json()
+            except asyncio.TimeoutError:
+                raise YouTubeSearchError(f"YouTube API did not answer within {self.timeout:g}s")
+            except aiohttp.ClientError as e:
+                raise YouTubeSearchError(f"YouTube API request failed: {e}")
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+def normalize_query(query):
+    return " ".join(query.casefold().split())
+
+
+class SearchCache:
+    """TTL/LRU cache of search responses with single-flight coalescing of identical queries.
+
+    Also keeps a per-day (UTC) tally of the quota units spent and saved.
+    """
+
+    def __init__(self, max_entries=512, ttl=6 * 3600, history_days=7):
+        self._results = cachetools.TTLCache(maxsize=max_entries, ttl=ttl)
+        self._in_flight = {}
+        self.history = deque(maxlen=history_days)
+        self.today = self._new_day()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_entries=int(os.getenv("SEARCH_CACHE_ENTRIES", "512")),
+            ttl=float(os.getenv("SEARCH_CACHE_TTL", str(6 * 3600))),
+        )
+
+    @staticmethod
+    def _new_day():
+        return {
+            'day': datetime.now(timezone.utc).date(),
+            'requests': 0,
+            'hits': 0,
+            'coalesced': 0,
+            'units_used': 0,
+            'units_saved': 0,
+        }
+
+    def _roll_day(self):
+        if self.today['day'] != datetime.now(timezone.utc).date():
+            self.history.append(self.today)
+            self.today = self._new_day()
+
+    async def get_or_fetch(self, query, fetch):
+        """Return the cached response for query, or run fetch(query) once for all concurrent callers"""
+        self._roll_day()
+        key = normalize_query(query)
+
+        cached = self._results.get(key)
+        if cached is not None:
+            self.today['hits'] += 1
+            self.today['units_saved'] += SEARCH_QUOTA_COST
+            return cached
+
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            self.today['coalesced'] += 1
+            self.today['units_saved'] += SEARCH_QUOTA_COST
+            return await asyncio.shield(in_flight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            self.today['requests'] += 1
+            self.today['units_used'] += SEARCH_QUOTA_COST
+            result = await fetch(query)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark it retrieved so asyncio doesn't warn when nobody else was waiting
+            future.exception()
+            raise
+        else:
+            self._results[key] = result
+            future.set_result(result)
+            return result
+        finally:
+            del self._in_flight[key]
+
+    def clear(self):
+        self._results.clear()
+
+    @property
+    def entries(self):
+        return len(self._results)
+
+
+search_cache = SearchCache.from_env()